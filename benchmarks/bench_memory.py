@@ -0,0 +1,74 @@
+"""
+Peak memory use of ``export`` for synthetic runs of increasing size.
+
+Each configuration is exported in a fresh process, which records the peak
+of the allocations traced by ``tracemalloc`` and the peak resident set size
+(RSS). The documents are generated lazily, so any growth with the number of
+rows comes from the Serializer retaining data. Run with::
+
+    python benchmarks/bench_memory.py
+
+The script fails if the traced peak of the longest runs exceeds that of the
+shortest runs of the same shape by more than ``TOLERANCE``.
+"""
+import multiprocessing
+import resource
+import sys
+import tempfile
+import tracemalloc
+
+from suitcase.csv import export
+
+from common import synthetic_run
+
+ROWS = (10000, 30000, 100000)  # at least one page of the largest size
+SHAPES = [  # (num_fields, num_streams, page_size)
+    (10, 1, 100),
+    (100, 1, 100),
+    (10, 3, 100),
+    (10, 1, 1),
+    (10, 1, 10000),
+    (10, 1, None),
+]
+TOLERANCE = 1.5
+
+
+def measure(config):
+    """Export one configuration and return (traced peak, RSS peak) in MiB."""
+    num_rows, (num_fields, num_streams, page_size) = config
+    with tempfile.TemporaryDirectory() as directory:
+        tracemalloc.start()
+        export(synthetic_run(num_rows, num_fields, page_size, num_streams),
+               directory)
+        _, traced = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # in KiB
+    return traced / 2**20, rss / 2**10
+
+
+def main():
+    configs = [(num_rows, shape) for shape in SHAPES for num_rows in ROWS]
+    # a fresh process per configuration, so that the RSS peaks are separate.
+    with multiprocessing.Pool(1, maxtasksperchild=1) as pool:
+        results = dict(zip(configs, pool.map(measure, configs, chunksize=1)))
+
+    print(f'{"fields":>7} {"streams":>8} {"page":>6} {"rows":>8} '
+          f'{"traced (MiB)":>13} {"RSS (MiB)":>10}')
+    failures = []
+    for shape in SHAPES:
+        for num_rows in ROWS:
+            traced, rss = results[num_rows, shape]
+            print(f'{shape[0]:>7} {shape[1]:>8} {str(shape[2]):>6} '
+                  f'{num_rows:>8} {traced:>13.1f} {rss:>10.1f}')
+        shortest, longest = (results[ROWS[0], shape][0],
+                             results[ROWS[-1], shape][0])
+        if longest > TOLERANCE * shortest:
+            failures.append(shape)
+
+    if failures:
+        sys.exit(f'The peak memory grows with the run length for the shapes '
+                 f'{failures!r}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Sequential read speed of exported files, with and without preallocation.
+
+A run with several interleaved streams is exported in small batches, so
+that the files grow together in many small appends, which is what leaves
+them fragmented. Each file is then evicted from the page cache and read
+sequentially. The number of extents of the files is shown where
+``filefrag`` is available. Run with::
+
+    python benchmarks/bench_preallocate.py [rows] [directory]
+
+The directory should be on the storage of interest, the default is a
+temporary directory.
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from suitcase.csv import export
+
+from common import synthetic_run
+
+NUM_FIELDS = 20
+NUM_STREAMS = 4
+BATCH_SIZE = 100
+PREALLOCATE = (None, 2**20, 2**24)  # bytes of the first extent
+CHUNK = 2**20  # bytes per read
+
+
+def evict(path):
+    """Drop the pages of a file from the page cache."""
+    with open(path, 'rb') as file:
+        os.fsync(file.fileno())
+        os.posix_fadvise(file.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def read_time(path):
+    """Return the seconds to read a file sequentially, from disk."""
+    evict(path)
+    t0 = time.perf_counter()
+    with open(path, 'rb', buffering=0) as file:
+        while file.read(CHUNK):
+            pass
+    return time.perf_counter() - t0
+
+
+def extents(path):
+    """Return the number of extents of a file, or None if unknown."""
+    if shutil.which('filefrag') is None:
+        return None
+    output = subprocess.run(['filefrag', path], capture_output=True,
+                            text=True).stdout
+    # "<path>: <n> extents found"
+    try:
+        return int(output.rsplit(':', 1)[1].split()[0])
+    except (IndexError, ValueError):
+        return None
+
+
+def measure(num_rows, directory, preallocate):
+    """Export a run and return (MiB, export seconds, read seconds, extents).
+    """
+    directory = tempfile.mkdtemp(dir=directory)
+    try:
+        t0 = time.perf_counter()
+        artifacts = export(
+            synthetic_run(num_rows, NUM_FIELDS, BATCH_SIZE, NUM_STREAMS),
+            directory, batch_size=BATCH_SIZE, preallocate=preallocate)
+        export_time = time.perf_counter() - t0
+        paths = artifacts['stream_data']
+        size = sum(os.path.getsize(path) for path in paths)
+        read = sum(read_time(path) for path in paths)
+        counts = [extents(path) for path in paths]
+        return (size / 2**20, export_time, read,
+                None if None in counts else sum(counts))
+    finally:
+        shutil.rmtree(directory)
+
+
+def main():
+    num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    directory = sys.argv[2] if len(sys.argv) > 2 else None
+    print(f'{"preallocate":>12} {"MiB":>8} {"export (s)":>11} '
+          f'{"read (MiB/s)":>13} {"extents":>8}')
+    for preallocate in PREALLOCATE:
+        size, export_time, read, count = measure(num_rows, directory,
+                                                 preallocate)
+        print(f'{str(preallocate):>12} {size:>8.1f} {export_time:>11.2f} '
+              f'{size / read:>13.1f} {str(count):>8}')
+
+
+if __name__ == '__main__':
+    main()
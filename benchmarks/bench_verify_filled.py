@@ -0,0 +1,67 @@
+"""
+Per-page cost of ``Serializer.event_page`` for wide descriptors.
+
+The Serializer decides once per descriptor whether pages need their
+``filled`` entries verified, and then only checks the external fields. This
+compares it with calling ``event_model.verify_filled`` on every page, which
+walks the ``filled`` entry of every field. Run with::
+
+    python benchmarks/bench_verify_filled.py
+"""
+import time
+import timeit
+
+import event_model
+import suitcase.utils
+from suitcase.csv import Serializer
+
+from common import synthetic_run
+
+NUM_PAGES = 50
+PAGE_SIZE = 100
+
+
+class AlwaysVerifySerializer(Serializer):
+    """The previous behaviour: verify every page in full."""
+    def event_page(self, doc):
+        event_model.verify_filled(doc)
+        return super().event_page(doc)
+
+
+def page_cost(serializer_class, documents):
+    """Return the best seconds per page of routing ``documents``."""
+    best = float('inf')
+    for _ in range(3):
+        serializer = serializer_class(suitcase.utils.MemoryBuffersManager())
+        t0 = time.perf_counter()
+        for name, doc in documents:
+            serializer(name, doc)
+        best = min(best, time.perf_counter() - t0)
+    return best / NUM_PAGES
+
+
+def main():
+    print(f'{"fields":>8} {"external":>8} {"verify_filled (us)":>20} '
+          f'{"verify every page (us)":>24} {"per descriptor (us)":>20}')
+    for num_fields in (10, 100, 1000):
+        for num_external in (0, 10):
+            documents = list(synthetic_run(NUM_PAGES * PAGE_SIZE, num_fields,
+                                           PAGE_SIZE,
+                                           num_external=num_external))
+            # emulate producers that fill in every field, external or not.
+            for name, doc in documents:
+                if name == 'event_page':
+                    doc['filled'] = {field: [True] * len(doc['seq_num'])
+                                     for field in doc['data']}
+            page = documents[2][1]
+            verify = min(timeit.repeat(
+                lambda: event_model.verify_filled(page),
+                number=100, repeat=3)) / 100
+            before = page_cost(AlwaysVerifySerializer, documents)
+            after = page_cost(Serializer, documents)
+            print(f'{num_fields:>8} {num_external:>8} {verify * 1e6:>20.0f} '
+                  f'{before * 1e6:>24.0f} {after * 1e6:>20.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Synthetic document streams shared by the benchmarks in this directory.
+
+The documents are built by hand rather than with ``event_model.compose_run``
+so that generating them does not dominate the timings.
+"""
+import itertools
+import uuid
+
+
+def synthetic_run(num_rows, num_fields, page_size=100, num_streams=1,
+                  num_external=0):
+    """
+    Yield the ``(name, doc)`` pairs of a run with scalar data.
+
+    Parameters
+    ----------
+    num_rows : int
+        Rows per stream.
+    num_fields : int
+        Scalar fields per stream.
+    page_size : int or None, optional
+        Rows per EventPage, or None to emit single Events.
+    num_streams : int, optional
+        Number of streams, which are interleaved page by page.
+    num_external : int, optional
+        Number of additional external fields (filled, with scalar values).
+    """
+    run_uid = str(uuid.uuid4())
+    yield 'start', {'uid': run_uid, 'time': 0.}
+    fields = [f'field{i}' for i in range(num_fields)]
+    external = [f'external{i}' for i in range(num_external)]
+    descriptors = []
+    for stream in range(num_streams):
+        data_keys = {field: {'source': 'synthetic', 'dtype': 'number',
+                             'shape': []} for field in fields}
+        data_keys.update({field: {'source': 'synthetic', 'dtype': 'number',
+                                  'shape': [], 'external': 'FILESTORE:'}
+                          for field in external})
+        descriptor = {'uid': str(uuid.uuid4()), 'run_start': run_uid,
+                      'time': 0., 'name': f'stream{stream}',
+                      'data_keys': data_keys}
+        descriptors.append(descriptor)
+        yield 'descriptor', descriptor
+
+    step = page_size or 1
+    for first in range(0, num_rows, step):
+        rows = range(first, min(first + step, num_rows))
+        for stream, descriptor in enumerate(descriptors):
+            times = [stream + 0.001 * i for i in rows]
+            data = {field: [float(i) for i in rows]
+                    for field in itertools.chain(fields, external)}
+            page = {'descriptor': descriptor['uid'],
+                    'uid': [str(i) for i in rows],
+                    'time': times,
+                    'seq_num': [i + 1 for i in rows],
+                    'data': data,
+                    'timestamps': {field: times for field in data},
+                    'filled': {field: [True] * len(rows)
+                               for field in external}}
+            if page_size is None:
+                yield 'event', {
+                    'descriptor': page['descriptor'], 'uid': page['uid'][0],
+                    'time': times[0], 'seq_num': page['seq_num'][0],
+                    'data': {field: value[0] for field, value in data.items()},
+                    'timestamps': {field: times[0] for field in data},
+                    'filled': {field: True for field in external}}
+            else:
+                yield 'event_page', page
+    yield 'stop', {'uid': str(uuid.uuid4()), 'run_start': run_uid,
+                   'time': 1., 'exit_status': 'success'}
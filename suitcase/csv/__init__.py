@@ -1,15 +1,38 @@
+import bz2
+import codecs
+from collections import deque
+import concurrent.futures
+import cProfile
 import event_model
+import gzip
+import hashlib
+import io
+import json
+import lzma
+import marshal
 import numpy
+import os
 import pandas
 from pathlib import Path
+import pstats
+import queue
+import shutil
+import struct
 import suitcase.utils
+import sys
+import tempfile
+import threading
+import time
+import warnings
+import zipfile
 from ._version import get_versions
 
 __version__ = get_versions()['version']
 del get_versions
 
 
-def export(gen, directory, file_prefix='{start[uid]}-', **kwargs):
+def export(gen, directory, file_prefix='{start[uid]}-', prefetch=0,
+           **kwargs):
     """
     Export a stream of documents to a series of csv files.
 
@@ -19,8 +42,10 @@ def export(gen, directory, file_prefix='{start[uid]}-', **kwargs):
 
     .. warning::
 
-        This process explicitly ignores all data that is not 1D and does not
-        include any metadata in the output file.
+        This process ignores all data that is not 1D, other than the vectors
+        expanded into columns with ``flatten_max_width`` and the waveforms
+        written in long format with ``tidy``, and does not include any
+        metadata in the output files.
 
     .. note::
 
@@ -45,6 +70,12 @@ def export(gen, directory, file_prefix='{start[uid]}-', **kwargs):
         interface. See the suitcase documentation
         (http://nsls-ii.github.io/suitcase/) for details.
 
+        A ``ZipArchiveManager`` writes the files into a single zip archive.
+        It streams only one text file at a time into the archive; the others
+        are held back until closed, and each one larger than its
+        ``spool_size`` is spilled to a temporary file on disk meanwhile. Pass
+        its ``stream`` to choose the file which is streamed.
+
     file_prefix : str, optional
         The first part of the filename of the generated output files. This
         string may include templates as in
@@ -54,8 +85,16 @@ def export(gen, directory, file_prefix='{start[uid]}-', **kwargs):
         descriptive value depends on the application and is therefore left to
         the user.
 
+    prefetch : int, optional
+        If given, the documents are pulled from ``gen`` by a separate thread,
+        up to this many ahead of the Serializer, so that a slow source (e.g.
+        decompressing or decoding) is read while the previous documents are
+        formatted and written. The documents are handled in the same order.
+        0, no prefetching, by default.
+
     **kwargs : kwargs
-        kwargs to be passed to ``pandas.DataFrame.to_csv``.
+        kwargs to be passed to ``Serializer``, such as ``flush`` or
+        ``profile``, or from there to ``pandas.DataFrame.to_csv``.
 
     Returns
     -------
@@ -83,12 +122,776 @@ def export(gen, directory, file_prefix='{start[uid]}-', **kwargs):
     >>> export(gen, '/path/to/my_usb_stick')
     """
     with Serializer(directory, file_prefix, **kwargs) as serializer:
-        for item in gen:
+        if hasattr(gen, '__len__'):
+            # a sequence of documents tells the progress reporter its size.
+            try:
+                name, doc = gen[-1]
+            except (IndexError, KeyError, TypeError, ValueError):
+                name, doc = None, None
+            serializer.expect(num_documents=len(gen), num_events=(
+                doc.get('num_events') if name == 'stop' else None))
+        for item in (_prefetch(gen, prefetch) if prefetch else gen):
             serializer(*item)
+    serializer.wait()
 
     return serializer.artifacts
 
 
+def _prefetch(gen, size):
+    '''Yield the items of ``gen``, read ahead by a thread into a queue.
+
+    Exceptions raised by ``gen`` are re-raised here, and the thread stops
+    when the generator returned is closed.
+    '''
+    items = queue.Queue(size)
+    stopped = threading.Event()
+    done = object()
+
+    def put(item):
+        # time out to notice when the consumer has stopped.
+        while not stopped.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def read():
+        try:
+            for item in gen:
+                if not put((item, None)):
+                    return
+        except BaseException as error:
+            put((done, error))
+        else:
+            put((done, None))
+
+    thread = threading.Thread(target=read, daemon=True,
+                              name='suitcase.csv prefetch')
+    thread.start()
+    try:
+        while True:
+            item, error = items.get()
+            if item is done:
+                thread.join()
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stopped.set()
+
+
+def load_binary_cache(path):
+    """
+    Load a stream from the binary cache written alongside its csv file.
+
+    The columns are memory mapped rather than read, so loading is nearly
+    free and only the data actually used is read from disk.
+
+    Parameters
+    ----------
+    path : string or Path
+        The ``<file_prefix>{stream_name}.cache`` directory written by
+        ``export(..., binary_cache=True)``.
+
+    Returns
+    -------
+    data : pandas.DataFrame
+        The numeric columns of the stream, indexed like the csv file.
+    """
+    path = Path(path)
+    with open(path / 'manifest.json') as file:
+        manifest = json.load(file)
+    # plain ndarray views of the memory maps, which pandas handles better.
+    columns = {column['name']: numpy.asarray(
+        numpy.load(path / column['file'], mmap_mode='r'))
+        for column in manifest['columns']}
+    index = pandas.Index(columns.pop(manifest['index']),
+                         name=manifest['index'])
+    return pandas.DataFrame(columns, index=index, copy=False)
+
+
+def recover_preallocated(path):
+    """
+    Truncate a ".csv" file preallocated by a Serializer which was not closed.
+
+    The file is cut at the first NUL byte after the length recorded in
+    ``<path>.length``, as the unwritten space reads as NUL bytes, which csv
+    text never contains. The record is then removed.
+
+    Parameters
+    ----------
+    path : string or Path
+        The ".csv" file written with ``export(..., preallocate=...)``.
+
+    Returns
+    -------
+    length : int
+        The length of the truncated file.
+    """
+    record = Path(f'{path}.length')
+    length = int(record.read_text())
+    with open(path, 'r+b') as file:
+        file.seek(length)
+        while True:
+            chunk = file.read(2**20)
+            end = chunk.find(b'\0')
+            if end >= 0:
+                length += end
+                break
+            length += len(chunk)
+            if not chunk:
+                break
+        file.truncate(length)
+    record.unlink()
+    return length
+
+
+class ZipArchiveManager:
+    """
+    A manager which writes all the files as members of one zip archive.
+
+    The archive is written as the files are: one text file at a time is
+    streamed directly into the archive, the first one opened or the first
+    one matching ``stream``. As the members of an archive cannot be
+    interleaved, the files written at the same time as it are held back, in
+    memory up to ``spool_size`` bytes each and spilled to temporary files
+    on disk beyond that. A held back file is added to the archive as soon
+    as it is closed while no file is being streamed, and otherwise once the
+    streamed file is closed, after which the next text file opened is
+    streamed. Binary files, which may be rewritten (as by
+    ``binary_cache``), are always held back.
+
+    Members are written in the zip64 format, with their sizes in data
+    descriptors, so neither the size of the members nor that of the archive
+    is limited and the archive may be written to an unseekable file.
+
+    Parameters
+    ----------
+    file : string, Path or file
+        The path of the archive, which must not exist yet, or a binary file
+        to write it to.
+    compression : int, optional
+        The compression of the members, such as ``zipfile.ZIP_DEFLATED``.
+        ``zipfile.ZIP_STORED``, for no compression, by default.
+    spool_size : int, optional
+        The number of bytes of each held back member kept in memory, beyond
+        which it is spilled to a temporary file. 64 MiB by default.
+    stream : string, optional
+        The label (such as 'stream_data') or the end of the name (such as
+        'primary.csv') of the files to stream, typically the largest. None,
+        the first text file opened, by default.
+
+    Examples
+    --------
+
+    Export a run into the single file 'run.zip', streaming the largest
+    stream.
+
+    >>> export(gen, ZipArchiveManager('run.zip', zipfile.ZIP_DEFLATED,
+    ...                               stream='primary.csv'))
+    """
+    def __init__(self, file, compression=zipfile.ZIP_STORED,
+                 spool_size=2**26, stream=None):
+        mode = 'x' if isinstance(file, (str, Path)) else 'w'
+        self._zipfile = zipfile.ZipFile(file, mode, compression,
+                                        allowZip64=True)
+        self._file = file
+        self._compression = compression
+        self._spool_size = spool_size
+        self._stream = stream
+        self._artifacts = []  # (label, postfix) pairs
+        self._handles = []  # the handles of all of the members
+        self._streaming = None  # the _ZipMember being streamed
+        self._held = []  # the _ZipMembers held back, in order
+
+    @property
+    def artifacts(self):
+        """
+        Provides dictionary mapping artifact labels to member names.
+
+        The archive itself has the label 'archive'.
+        """
+        artifacts = {'archive': [self._file]}
+        for label, postfix in self._artifacts:
+            artifacts.setdefault(label, []).append(postfix)
+        return artifacts
+
+    def reserve_name(self, label, postfix):
+        """
+        This action is not valid on this manager. It will always raise.
+        """
+        raise suitcase.utils.SuitcaseUtilsTypeError(
+            "ZipArchiveManager is incompatible with exporters that require "
+            "explicit filenames.")
+
+    def open(self, label, postfix, mode, encoding=None, errors=None):
+        """
+        Request a file handle for a new member of the archive.
+
+        Parameters
+        ----------
+        label : string
+            A label for the sort of content being stored, such as
+            'stream_data' or 'metadata'.
+        postfix : string
+            The name of the member. Must be unique for this Manager.
+        mode : {'x', 'xt', xb'}
+            'x' or 'xt' for text, 'xb' for binary
+        encoding : string or None
+            Passed through to the text wrapper. Only applicable to text mode.
+        errors : string or None
+            Passed through to the text wrapper.
+
+        Returns
+        -------
+        file : handle
+        """
+        if mode not in ('x', 'xt', 'xb'):
+            raise suitcase.utils.ModeError(
+                f"The mode passed to ZipArchiveManager.open is {mode} but "
+                f"needs to be one of {{'x', 'xt', 'xb'}}")
+        if postfix in (postfix for _, postfix in self._artifacts):
+            raise suitcase.utils.SuitcaseUtilsValueError(
+                f"The postfix {postfix!r} has already been used.")
+        self._artifacts.append((label, postfix))
+
+        stream = (self._streaming is None and mode != 'xb'
+                  and (self._stream is None or label == self._stream
+                       or postfix.endswith(self._stream)))
+        if stream:
+            member = self._streaming = _ZipMember(
+                self, postfix, self._zipfile.open(self._zipinfo(postfix), 'w',
+                                                  force_zip64=True))
+        else:
+            member = _ZipMember(
+                self, postfix, tempfile.SpooledTemporaryFile(self._spool_size))
+            self._held.append(member)
+        if mode == 'xb':
+            handle = member
+        else:
+            handle = io.TextIOWrapper(member, encoding=encoding or 'utf-8',
+                                      errors=errors)
+        # the streamed member first, so that closing them all adds the held
+        # back members as they are closed.
+        self._handles.insert(0 if stream else len(self._handles), handle)
+        return handle
+
+    def _zipinfo(self, postfix):
+        zipinfo = zipfile.ZipInfo(postfix, time.localtime()[:6])
+        zipinfo.compress_type = self._compression
+        return zipinfo
+
+    def close(self):
+        """
+        Close all of the members, adding the held back ones, and close the
+        archive.
+        """
+        for handle in self._handles:
+            handle.close()
+        self._handles = []
+        self._zipfile.close()
+
+    def _member_closed(self, member):
+        '''Finish a closed member, and add the closed held back members if
+        none is being streamed.'''
+        if member is self._streaming:
+            member.raw.close()
+            self._streaming = None
+            self._stream = None  # any file opened from now on may be streamed
+        if self._streaming is not None:
+            return
+        while self._held and self._held[0].closed:
+            held = self._held.pop(0)
+            held.raw.seek(0)
+            with self._zipfile.open(self._zipinfo(held.postfix), 'w',
+                                    force_zip64=True) as archived:
+                shutil.copyfileobj(held.raw, archived)
+            held.raw.close()
+
+
+class _ZipMember(io.RawIOBase):
+    """
+    A member of the archive of a ``ZipArchiveManager``, written directly to
+    the archive or to a spooled file if held back.
+
+    Closing it tells the manager, which then adds or finishes it.
+    """
+    def __init__(self, manager, postfix, raw):
+        self.manager = manager
+        self.postfix = postfix
+        self.raw = raw
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return self.raw.seekable()
+
+    def write(self, data):
+        return self.raw.write(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self.raw.seek(offset, whence)
+
+    def tell(self):
+        return self.raw.tell()
+
+    def close(self):
+        if not self.closed:
+            super().close()
+            self.manager._member_closed(self)
+
+
+class TeeManager:
+    """
+    A manager which writes each file to several destinations at once.
+
+    Each write is encoded once and the same bytes are written to every
+    destination, optionally compressed, so the cost of formatting does not
+    depend on the number of destinations. The files are opened in binary
+    mode on the managers of the destinations, so memory buffers hold bytes.
+
+    Parameters
+    ----------
+    *destinations : string, Path, Manager or tuple
+        The directories, as for ``Serializer``, or managers to write to.
+        A tuple ``(destination, compression)``, where compression is one of
+        'gzip', 'bz2' or 'xz', compresses the files of that destination and
+        appends '.gz', '.bz2' or '.xz' to their names. Compressed files
+        cannot be rewritten, as by ``binary_cache``.
+
+    Examples
+    --------
+
+    Write the files to a directory and to memory buffers, and a compressed
+    copy to an archive directory.
+
+    >>> export(gen, TeeManager('data', MemoryBuffersManager(),
+    ...                        ('archive', 'gzip')))
+    """
+    _compressions = {'gzip': ('.gz', lambda raw: gzip.GzipFile(
+                                  fileobj=raw, mode='wb')),
+                     'bz2': ('.bz2', lambda raw: bz2.BZ2File(raw, 'wb')),
+                     'xz': ('.xz', lambda raw: lzma.LZMAFile(raw, 'wb'))}
+
+    def __init__(self, *destinations):
+        self._destinations = []  # (manager, compression) pairs
+        for destination in destinations:
+            destination, compression = (destination if isinstance(
+                destination, tuple) else (destination, None))
+            if compression not in (None, *self._compressions):
+                raise ValueError(f"Unknown compression {compression!r}, it "
+                                 f"must be one of "
+                                 f"{', '.join(self._compressions)}.")
+            if isinstance(destination, (str, Path)):
+                destination = suitcase.utils.MultiFileManager(destination)
+            self._destinations.append((destination, compression))
+        self._files = []
+
+    @property
+    def artifacts(self):
+        """
+        Provides dictionary mapping artifact labels to the artifacts of all
+        the destinations, in order.
+        """
+        artifacts = {}
+        for manager, _ in self._destinations:
+            for label, names in manager.artifacts.items():
+                artifacts.setdefault(label, []).extend(names)
+        return artifacts
+
+    def reserve_name(self, label, postfix):
+        """
+        This action is not valid on this manager. It will always raise.
+        """
+        raise suitcase.utils.SuitcaseUtilsTypeError(
+            "TeeManager is incompatible with exporters that require explicit "
+            "filenames.")
+
+    def open(self, label, postfix, mode, encoding=None, errors=None):
+        """
+        Request a file handle writing to every destination.
+
+        Parameters
+        ----------
+        label : string
+            A label for the sort of content being stored, such as
+            'stream_data' or 'metadata'.
+        postfix : string
+            Postfix for the file name. Must be unique for this Manager.
+        mode : {'x', 'xt', xb'}
+            'x' or 'xt' for text, 'xb' for binary
+        encoding : string or None
+            Used to encode text. 'utf-8' by default.
+        errors : string or None
+            Passed through to the encoding of text.
+
+        Returns
+        -------
+        file : handle
+        """
+        if mode not in ('x', 'xt', 'xb'):
+            raise suitcase.utils.ModeError(
+                f"The mode passed to TeeManager.open is {mode} but needs to "
+                f"be one of {{'x', 'xt', 'xb'}}")
+        raws = []
+        for manager, compression in self._destinations:
+            if compression is None:
+                raws.append(manager.open(label, postfix, 'xb'))
+            else:
+                extension, compressor = self._compressions[compression]
+                raws.append(compressor(
+                    manager.open(label, postfix + extension, 'xb')))
+        file = _TeeFile(raws, None if mode == 'xb' else encoding or 'utf-8',
+                        errors or 'strict')
+        self._files.append(file)
+        return file
+
+    def close(self):
+        """
+        Close all files opened by the manager, and the destinations.
+        """
+        for file in self._files:
+            file.close()
+        for manager, _ in self._destinations:
+            manager.close()
+
+
+class _TeeFile:
+    """
+    A file handle writing the same bytes to several binary files.
+
+    Text is encoded once for all of the files, and bytes already encoded by
+    the caller are written as they are.
+
+    Parameters
+    ----------
+    raws : list
+        The binary files.
+    encoding : str or None
+        The encoding of text, or None if this is a binary file.
+    errors : str
+        How encoding errors are handled.
+    """
+    def __init__(self, raws, encoding, errors):
+        self._raws = raws
+        self.encoding = encoding
+        self.errors = errors
+        self.closed = False
+
+    def write(self, data):
+        # text is encoded, bytes encoded by the caller are written as is.
+        if isinstance(data, str):
+            data = data.encode(self.encoding or 'utf-8', self.errors)
+        for raw in self._raws:
+            raw.write(data)
+        return len(data)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def seek(self, offset, whence=0):
+        for raw in self._raws:
+            position = raw.seek(offset, whence)
+        return position
+
+    def tell(self):
+        return self._raws[0].tell()
+
+    def flush(self):
+        for raw in self._raws:
+            raw.flush()
+
+    def close(self):
+        # the managers close the files they opened, but the compressors,
+        # which do not close the files they wrap, are closed here.
+        if not self.closed:
+            for raw in self._raws:
+                if isinstance(raw, (gzip.GzipFile, bz2.BZ2File,
+                                    lzma.LZMAFile)):
+                    raw.close()
+                else:
+                    raw.flush()
+            self.closed = True
+
+
+def serializer_factory(directory, file_prefix='{start[uid]}-', **kwargs):
+    """
+    Return a factory of Serializers, one per run, for ``RunRouter``.
+
+    Parameters
+    ----------
+    directory : string or Path
+        The output directory, shared by the runs. A manager cannot be used,
+        as the first run to stop would close it.
+    file_prefix : str, optional
+        As for ``Serializer``. It should be unique for every run, as the
+        default is.
+    **kwargs : kwargs
+        kwargs to be passed to ``Serializer``.
+
+    Examples
+    --------
+
+    Export each of several interleaved runs to its own set of files.
+
+    >>> router = event_model.RunRouter([serializer_factory('data')])
+    >>> for name, doc in interleaved_documents:
+    ...     router(name, doc)
+    """
+    if not isinstance(directory, (str, Path)):
+        raise ValueError("The directory of several runs must be a string or "
+                         "Path.")
+
+    def factory(name, start_doc):
+        return [Serializer(directory, file_prefix, **kwargs)], []
+
+    return factory
+
+
+class MultiRunSerializer:
+    """
+    Export the interleaved documents of concurrent runs, in parallel.
+
+    The documents are routed to a Serializer per run by an
+    ``event_model.RunRouter``. Each run's documents are queued and handled
+    in order on a pool of writer threads shared by all of the runs, so that
+    one slow run does not hold up the others. A run's Serializer is closed,
+    and its resources released, as soon as its stop document is handled.
+
+    Parameters
+    ----------
+    directory : string or Path
+        The output directory, shared by the runs.
+    file_prefix : str, optional
+        As for ``Serializer``. It should be unique for every run, as the
+        default is.
+    max_workers : int, optional
+        The number of writer threads. 4 by default.
+    max_open_files : int, optional
+        A budget of files open at once, over all of the runs. Each run
+        reserves a file per stream of its descriptors, and at least one, from
+        when it starts writing until it stops, or the files it opened if
+        more. A new run only starts writing while its reservation fits in
+        what the runs being written leave of the budget, otherwise its
+        documents are held in memory until enough runs stop. A run is never
+        held up once it has started, and a run is started when no other is
+        being written, so a single run may exceed the budget. None, no
+        limit, by default.
+    max_pending : int, optional
+        The number of documents queued for the writers. Calls block while it
+        is reached. 1000 by default.
+    **kwargs : kwargs
+        kwargs to be passed to ``Serializer``.
+
+    Examples
+    --------
+
+    >>> with MultiRunSerializer('data', max_open_files=64) as serializer:
+    ...     for name, doc in interleaved_documents:
+    ...         serializer(name, doc)
+    >>> serializer.artifacts  # maps the RunStart uids to their artifacts
+    """
+    def __init__(self, directory, file_prefix='{start[uid]}-', max_workers=4,
+                 max_open_files=None, max_pending=1000, **kwargs):
+        self._factory = serializer_factory(directory, file_prefix, **kwargs)
+        self._max_open_files = max_open_files
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers, thread_name_prefix='suitcase.csv writer')
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._finished = threading.Condition(self._lock)
+        self._open_files = 0
+        self._waiting = deque()  # the runs waiting for files, in order
+        self._runs = {}  # maps RunStart uids to the runs not yet stopped
+        self._artifacts = {}  # maps RunStart uids to the artifacts of a run
+        self._error = None
+        self._router = event_model.RunRouter([self._start_run])
+        self._closed = False
+
+    @property
+    def artifacts(self):
+        '''Maps the RunStart uid of each closed run to its artifacts.'''
+        return dict(self._artifacts)
+
+    def __call__(self, name, doc):
+        if self._closed:
+            raise RuntimeError("The MultiRunSerializer is closed.")
+        self._raise_error()
+        self._router(name, doc)
+
+    def close(self):
+        '''Wait for the queued documents, and close the runs which did not
+        stop.
+
+        The runs still waiting for files are started as the budget allows.
+        '''
+        if self._closed:
+            return
+        self._closed = True
+        with self._lock:
+            runs = list(self._runs.values())
+        for run in runs:
+            run.stop()
+        with self._lock:
+            while self._runs:
+                self._finished.wait()
+        self._executor.shutdown(wait=True)
+        self._raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception_details):
+        self.close()
+
+    def _start_run(self, name, start_doc):
+        run = self._runs[start_doc['uid']] = _Run(self, start_doc['uid'])
+        serializers, _ = self._factory(name, start_doc)
+        run.serializer, = serializers
+        run.serializer.register_hook('on_file_open', run.file_opened)
+        with self._lock:
+            if self._max_open_files is None or self._fits(run):
+                run.admit()
+            else:
+                self._waiting.append(run)
+        return [run], []
+
+    def _fits(self, run):
+        '''Whether the files of a run fit in the budget, called with the lock
+        held.'''
+        return (self._open_files == 0 or
+                self._open_files + run.files <= self._max_open_files)
+
+    def _run_finished(self, run):
+        '''Release the files of a run, and start the runs waiting for them.
+        '''
+        with self._lock:
+            self._runs.pop(run.uid, None)
+            if run.error is None:
+                self._artifacts[run.uid] = run.serializer.artifacts
+            elif self._error is None:
+                self._error = run.error
+            self._open_files -= run.files
+            while self._waiting and self._fits(self._waiting[0]):
+                self._waiting.popleft().admit()
+            self._finished.notify_all()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+
+class _Run:
+    """
+    The queue of documents of one run of a ``MultiRunSerializer``.
+
+    The documents are handled in order, by at most one writer thread at a
+    time.
+    """
+    def __init__(self, owner, uid):
+        self.owner = owner
+        self.uid = uid
+        self.serializer = None
+        self.streams = set()  # the stream names of the descriptors
+        self.opened = 0  # the files opened by the serializer
+        self.error = None
+        self._queue = deque()  # (name, doc, counted) triples
+        self._lock = threading.Lock()
+        self._admitted = False
+        self._scheduled = False
+        self._stopping = False  # finish once the queue is drained
+        self._finished = False
+
+    @property
+    def files(self):
+        '''The files reserved by the run, or opened if more.'''
+        return max(len(self.streams), self.opened, 1)
+
+    def __call__(self, name, doc):
+        if name == 'descriptor' and doc.get('name') not in self.streams:
+            with self.owner._lock:
+                files = self.files
+                self.streams.add(doc.get('name'))
+                if self._admitted:
+                    self.owner._open_files += self.files - files
+        # only the documents of started runs count towards max_pending, as
+        # the writers cannot take on those of waiting runs.
+        counted = self._admitted
+        if counted:
+            self.owner._pending.acquire()
+        with self._lock:
+            self._queue.append((name, doc, counted))
+            self._schedule()
+
+    def admit(self):
+        '''Reserve the files of the run and start writing its documents,
+        called with the owner's lock held.'''
+        self.owner._open_files += self.files
+        with self._lock:
+            self._admitted = True
+            self._schedule()
+
+    def file_opened(self, key, filename):
+        with self.owner._lock:
+            files = self.files
+            self.opened += 1
+            self.owner._open_files += self.files - files
+
+    def stop(self):
+        '''Finish the run once its queued documents are written, without a
+        stop document.'''
+        with self._lock:
+            self._stopping = True
+            self._schedule()
+
+    def finish(self):
+        '''Close the Serializer, and release its resources.'''
+        with self._lock:
+            if self._finished:
+                return
+            self._finished = True
+        try:
+            self.serializer.close()
+            self.serializer.wait()
+        except Exception as error:
+            self.error = self.error or error
+        self.owner._run_finished(self)
+
+    def _schedule(self):
+        if (self._admitted and (self._queue or self._stopping)
+                and not self._scheduled and not self._finished):
+            self._scheduled = True
+            self.owner._executor.submit(self._drain)
+
+    def _drain(self):
+        while True:
+            with self._lock:
+                if not self._queue:
+                    self._scheduled = False
+                    stopping = self._stopping
+                    break
+                name, doc, counted = self._queue.popleft()
+            try:
+                if self.error is None:
+                    self.serializer(name, doc)
+            except Exception as error:
+                self.error = error
+                self.finish()
+            finally:
+                if counted:
+                    self.owner._pending.release()
+            if name == 'stop' and self.error is None:
+                self.finish()
+        if stopping:
+            self.finish()
+
+
 class Serializer(event_model.DocumentRouter):
     """
     Serialize a stream of documents to a set of csvs.
@@ -97,10 +900,17 @@ class Serializer(event_model.DocumentRouter):
     ``<directory>/<file_prefix>{stream_name}.csv``
     for every Event stream that contains 1D 'tabular like' data.
 
+    The columns of a stream are the 1D fields of all of its descriptors. Rows
+    without some of them leave those columns empty, and a descriptor with new
+    fields starts a new segment, ``{stream_name}.1.csv`` and so on, with an
+    updated header.
+
     .. warning::
 
-        This process explicitly ignores all data that is not 1D and does not
-        include any metadata in the output file.
+        This process ignores all data that is not 1D, other than the vectors
+        expanded into columns with ``flatten_max_width`` and the waveforms
+        written in long format with ``tidy``, and does not include any
+        metadata in the output files.
 
 
     .. note::
@@ -123,6 +933,9 @@ class Serializer(event_model.DocumentRouter):
         inferface. See the suitcase documentation
         (http://nsls-ii.github.io/suitcase/) for details.
 
+        A list of these writes the same files to each of them, with a
+        ``TeeManager``.
+
     file_prefix : str, optional
         The first part of the filename of the generated output files. This
         string may include templates as in
@@ -137,6 +950,174 @@ class Serializer(event_model.DocumentRouter):
         the full document stream is slower but each document is immediately
         available for reading. False by default.
 
+    batch_size : int, optional
+        The number of rows buffered per stream before they are formatted and
+        written in one go. Ignored when ``flush`` is True, in which case each
+        document is written immediately. 1000 by default.
+
+    target_latency : float, optional
+        If given, the number of rows buffered per stream adapts so that
+        writing them takes about this many seconds, based on the latency of
+        the previous writes of the stream. It starts at ``batch_size``, at
+        most doubles or halves after each write, and stays between 1 and 100
+        times ``batch_size``. The current value is reported in ``stats``.
+        None by default.
+
+    merge : iterable of str, optional
+        Names of streams to additionally merge, on time, into one file named
+        ``<directory>/<file_prefix>merged.csv`` with a ``<stream>.<field>``
+        column for every 1D field. Each row of any of these streams becomes
+        a row of the merged file and the fields of the other streams are
+        forward filled, as in ``pandas.merge_asof``. Rows are merged as the
+        streams are written, so each stream is expected to be in time order.
+        The columns are those of the first rows merged. The columns of a
+        stream whose first rows are merged later are added after them, which
+        starts a new segment, ``merged.1.csv`` and so on, as for the streams.
+        None by default.
+
+    merge_window : int, optional
+        The maximum number of rows held back waiting for the slowest of the
+        ``merge`` streams. When it is exceeded, the pending rows are merged
+        regardless, which bounds memory use for streams with few rows, such
+        as 'baseline'. 10000 by default.
+
+    resample : dict, optional
+        Maps stream names to a period, in seconds. The rows of these streams
+        are aggregated into buckets of that period, aligned to multiples of
+        it, and only one row per bucket is written, with the start time of
+        the bucket. Each stream is expected to be in time order. None by
+        default.
+
+    resample_method : {'mean', 'last', 'min', 'max'}, optional
+        How the rows in each ``resample`` bucket are aggregated. Non-numeric
+        fields and 'seq_num' always take the last value. 'mean' by default.
+
+    decimate : dict, optional
+        Maps stream names to a factor N. The rows of these streams are split
+        into consecutive windows of N rows, counted from the first row of the
+        stream, and each window is reduced according to ``decimate_method``.
+        None by default.
+
+    decimate_method : {'nth', 'envelope'}, optional
+        'nth' keeps the first row of each window. 'envelope' writes one row
+        per window, with the time and 'seq_num' of its first row and
+        ``<field>_min`` and ``<field>_max`` columns for each numeric field,
+        which preserves peaks. 'nth' by default.
+
+    decimate_alongside : boolean, optional
+        If True, the full stream is written as usual and the decimated rows
+        are written to an additional file named
+        ``<directory>/<file_prefix>{stream_name}.decimated.csv``. False by
+        default.
+
+    binary_cache : boolean, optional
+        If True, the numeric columns written to each ".csv" file are also
+        appended to a columnar binary cache in the directory
+        ``<directory>/<file_prefix>{stream_name}.cache``, with one ".npy"
+        file per column and a "manifest.json". The cache is complete once
+        the Serializer is closed, and can be loaded quickly with
+        ``load_binary_cache``. False by default.
+
+    hooks : dict, optional
+        Maps hook names to a callable, or a list of callables, to register
+        with ``register_hook``. None by default.
+
+    progress : boolean or callable, optional
+        If True, the progress of the export (the rows of each stream, their
+        rate and the estimated time left) is shown on ``sys.stderr``. A
+        callable is registered as an 'on_progress' hook instead. The totals
+        are taken from ``expect``, which ``export`` calls when the documents
+        are a sequence, or from the stop document. None by default.
+
+    progress_interval : float, optional
+        The minimum number of seconds between progress reports. 1 by default.
+
+    max_bytes_per_second : float, optional
+        If given, writes of all the files are rate limited to this many bytes
+        per second on average, by a token bucket shared by the files, so
+        that background exports leave bandwidth to other users of the
+        storage. The time spent waiting is reported in ``stats``. None, for
+        no limit, by default.
+
+    max_burst_bytes : float, optional
+        The number of bytes which may be written at once, without waiting,
+        after a pause in writing. ``max_bytes_per_second`` by default.
+
+    staging_directory : string or Path, optional
+        If given, the files are written to this directory, typically on a
+        fast local disk, and moved to ``directory``, which must then be a
+        string or Path, by a background thread once the Serializer is
+        closed. Each file is copied next to its destination, checked to have
+        the same size and then renamed into place. ``artifacts`` gives the
+        final path of each file moved so far and ``wait`` waits for all of
+        them. None by default.
+
+    preallocate : int, optional
+        If given, the space of each ".csv" file is reserved ahead of the
+        writes with ``os.posix_fallocate``, in extents which start at this
+        many bytes and double as the file grows (up to 1 GiB), so that large
+        files are laid out contiguously on disk. Files are truncated to the
+        size of their data when the Serializer is closed. Until then, the
+        length of the data is recorded in ``<file>.length``, so that
+        ``recover_preallocated`` can truncate the file after a crash. This
+        requires ``directory`` to be a string or Path. None by default.
+
+    checksum : string, optional
+        The name of a ``hashlib`` algorithm, such as 'sha256'. If given, the
+        bytes of each ".csv" file are hashed as they are written and, when
+        the Serializer is closed, the digests are written to
+        ``<directory>/<file_prefix>checksums.<checksum>`` in the format of
+        ``sha256sum`` and similar tools. They are also available from
+        ``checksums``. None by default.
+
+    flatten_max_width : int, optional
+        If given, fields whose value in each Event is a vector of at most
+        this many elements, such as the channels of an electrometer or a
+        short spectrum, are expanded into the columns ``{field}_0`` to
+        ``{field}_{N-1}``. The length is found from the first Event, and
+        must agree with the shape in the descriptor if that is given. Longer
+        vectors and other arrays are ignored. None, ignoring all arrays, by
+        default.
+
+    tidy : boolean or iterable of str, optional
+        If True, fields whose value in each Event is a 1D array (a waveform,
+        possibly of varying length) that is not expanded into columns by
+        ``flatten_max_width`` are written in long format, one row per point,
+        to ``<directory>/<file_prefix>{stream_name}.{field}.tidy.csv``, with
+        the columns time, seq_num, index (within the waveform) and value. If
+        an iterable, only the fields it names are. False by default.
+
+    tidy_chunk_size : int, optional
+        The number of waveform points buffered per tidy file before they are
+        written, which is also the most written in one go. 65536 by default.
+
+    layout : {'stream', 'field'}, optional
+        With 'stream', all of the columns of a stream are written to one
+        file. With 'field', each column is written to its own file,
+        ``<directory>/<file_prefix>{stream_name}.{field}.csv``, along with
+        the time and seq_num, so that a reader of a very wide stream can load
+        only the columns it needs. The files are created as their columns
+        are first written. 'stream' by default.
+
+    column_stats : boolean, optional
+        If True, running statistics of the numeric columns of each stream
+        (the count of values, the count of NaN, the minimum, maximum, mean
+        and population variance) are updated as each page is written, and
+        written to ``<directory>/<file_prefix>column_stats.json`` when the
+        Serializer is closed. They are also available from ``column_stats``.
+        False by default.
+
+    profile : boolean, string or Path, optional
+        If given, the work done by the Serializer for each document is
+        recorded with ``cProfile``. When it is closed, a report with the time
+        spent in each phase (classifying and buffering rows, building frames,
+        formatting, writing and flushing) and the most expensive functions is
+        written, along with the raw profile for use with ``pstats``. If True,
+        these are written next to the other files as
+        ``<file_prefix>profile.txt`` and ``<file_prefix>profile.prof``,
+        otherwise to the given path and the path with ".prof" appended. This
+        slows down the Serializer. None by default.
+
     **kwargs : kwargs
         kwargs to be passed to ``pandas.Dataframe.to_csv``.
 
@@ -160,33 +1141,277 @@ class Serializer(event_model.DocumentRouter):
     >>> export(gen, '/path/to/my_usb_stick')
     """
     def __init__(self, directory, file_prefix='{start[uid]}-', flush=False,
-                 **kwargs):
-
-        if isinstance(directory, (str, Path)):
+                 batch_size=1000, target_latency=None, merge=None,
+                 merge_window=10000,
+                 resample=None, resample_method='mean', decimate=None,
+                 decimate_method='nth', decimate_alongside=False,
+                 binary_cache=False, hooks=None, profile=None,
+                 max_bytes_per_second=None, max_burst_bytes=None,
+                 staging_directory=None, checksum=None, column_stats=False,
+                 progress=None, progress_interval=1.,
+                 flatten_max_width=None, tidy=False, tidy_chunk_size=65536,
+                 layout='stream', preallocate=None, **kwargs):
+
+        self._promoter = None
+        if staging_directory is not None:
+            if not isinstance(directory, (str, Path)):
+                raise ValueError("A staging_directory can only be used when "
+                                 "directory is a string or Path.")
+            self._manager = suitcase.utils.MultiFileManager(staging_directory)
+            self._promoter = _Promoter(staging_directory, directory)
+        elif isinstance(directory, (str, Path)):
             self._manager = suitcase.utils.MultiFileManager(directory)
+        elif isinstance(directory, (list, tuple)):
+            self._manager = TeeManager(*directory)
         else:
             self._manager = directory
 
         self._streamnames = {}  # maps descriptor uids to stream_names
-        self._files = {}  # maps stream_name to file
+        self._fields = {}  # maps descriptor uids to their 1D fields, in order
+        self._seen = {}  # maps descriptor uids to the set of fields classified
+        self._external = {}  # maps descriptor uids to their external fields
+        self._dtypes = {}  # maps descriptor uids to their fields' dtypes
+        self._shapes = {}  # maps descriptor uids to their fields' shapes
+        # maps descriptor uids to the length of their vector fields, or 0
+        self._widths = {}
+        if layout not in ('stream', 'field'):
+            raise ValueError(f"Unknown layout {layout!r}, it must be 'stream' "
+                             f"or 'field'.")
+        self._layout = layout
+        self._flatten_max_width = flatten_max_width
+        self._tidy = tidy if isinstance(tidy, bool) else set(tidy or ())
+        self._tidy_chunk_size = tidy_chunk_size
+        self._tidy_fields = {}  # maps descriptor uids to their tidy fields
+        self._tidy_buffers = {}  # maps the keys of tidy files to _TidyBuffer
+        self._schemas = {}  # maps stream_names to their columns, in order
+        self._stream_dtypes = {}  # maps stream_names to their fields' dtypes
+        self._stream_widths = {}  # maps stream_names to their fields' widths
+        self._buffers = {}  # maps stream_name to a _StreamBuffer
+        self._files = {}  # maps stream_name (or 'merged') to its current file
+        self._headers = {}  # maps stream_name to the columns of its file
+        self._segments = {}  # maps stream_name to the number of its file
+        self._merger = _Merger(merge, merge_window) if merge else None
+        # maps stream_name to a transform applied to its rows before writing
+        self._transforms = {
+            streamname: _Resampler(period, resample_method)
+            for streamname, period in (resample or {}).items()}
+        if checksum is not None:
+            hashlib.new(checksum)  # raises if the algorithm is unknown
+        self._checksum = checksum
+        # maps stream_name to the _ColumnStats of its columns, if enabled
+        self._column_stats = {} if column_stats else None
+        self._hashes = {}  # maps filenames to hashes
+        self._filenames = {}  # maps stream_name to the name of its file
+        self._binary_cache = binary_cache
+        self._throttle = None
+        if max_bytes_per_second is not None:
+            self._throttle = _TokenBucket(max_bytes_per_second,
+                                          max_burst_bytes)
+        self._caches = {}  # maps stream_name to a _BinaryCache
+        # maps stream_name to a transform written to a file of its own
+        self._decimators = {}
+        for streamname, factor in (decimate or {}).items():
+            decimator = _Decimator(factor, decimate_method)
+            if decimate_alongside:
+                self._decimators[streamname] = decimator
+            elif streamname in self._transforms:
+                raise ValueError(f"The stream {streamname!r} cannot be both "
+                                 f"resampled and decimated.")
+            else:
+                self._transforms[streamname] = decimator
         self._file_prefix = file_prefix
         self._templated_file_prefix = ''
         self._start_found = False
 
-        self._has_header = set()  # a set of uids to tell a file has a header
-
         kwargs.setdefault('header', True)
         self._initial_header_kwarg = kwargs['header']  # to set the headers
         kwargs.setdefault('index_label', 'time')
         kwargs.setdefault('mode', 'a')
+        self._index_key = kwargs['index_label']
         self._flush = flush
+        self._batch_size = batch_size
+        self._target_latency = target_latency
+        self._stats = {}  # maps stream_name to a dict of statistics
+        self._write_span = {}  # maps stream_name to [first start, last end]
+        self._profile = profile
+        self._profiler = cProfile.Profile() if profile else None
+        self._profile_time = 0.  # seconds spent handling documents
+        self._call_start = None  # when handling the current document began
+        self._hooks = {name: [] for name in _HOOKS}
+        self._progress = _Progress(progress_interval)
+        if progress is True:
+            self.register_hook('on_progress', _ProgressRenderer(sys.stderr))
+        elif progress:
+            self.register_hook('on_progress', progress)
+        for name, callbacks in (hooks or {}).items():
+            for callback in (callbacks if isinstance(callbacks, (list, tuple))
+                             else [callbacks]):
+                self.register_hook(name, callback)
         self._kwargs = kwargs
+        if preallocate and not isinstance(self._manager,
+                                          suitcase.utils.MultiFileManager):
+            raise ValueError("preallocate can only be used when directory is "
+                             "a string or Path.")
+        if preallocate and not hasattr(os, 'posix_fallocate'):
+            warnings.warn("os.posix_fallocate is not available on this "
+                          "platform, so the files are not preallocated.")
+            preallocate = None
+        self._preallocate = preallocate
+        self._preallocators = {}  # maps stream_name to its _Preallocator
+        self._closed = False
 
     @property
     def artifacts(self):
         # The manager's artifacts attribute is itself a property, and we must
         # access it a new each time to be sure to get the latest content.
-        return self._manager.artifacts
+        artifacts = self._manager.artifacts
+        if self._promoter is not None:
+            promoted = self._promoter.promoted
+            artifacts = {label: [promoted.get(name, name) for name in names]
+                         for label, names in artifacts.items()}
+        return artifacts
+
+    @property
+    def checksums(self):
+        '''Maps the name of each ".csv" file to the hex digest of its bytes.
+
+        Empty unless a ``checksum`` algorithm was given.
+        '''
+        return {filename: hash_.hexdigest()
+                for filename, hash_ in self._hashes.items()}
+
+    @property
+    def column_stats(self):
+        '''Maps each stream name to the statistics of its numeric columns.
+
+        Empty unless ``column_stats`` was enabled.
+        '''
+        return {streamname: stats.to_dict()
+                for streamname, stats in (self._column_stats or {}).items()}
+
+    def wait(self, timeout=None):
+        '''Wait for the files to be moved from the ``staging_directory``.
+
+        This returns immediately if there is no ``staging_directory``, and
+        re-raises any error which stopped the files from being moved.
+
+        Parameters:
+        -----------
+        timeout : float, optional
+            The maximum number of seconds to wait.
+        '''
+        if self._promoter is not None:
+            self._promoter.wait(timeout)
+
+    @property
+    def stats(self):
+        '''Statistics of the writes of each file so far.
+
+        Maps the keys of the outputs (the stream names, 'merged' and the
+        others listed in ``register_hook``) to dicts with the numbers of
+        'rows', 'bytes' and 'writes', the seconds spent building frames from
+        the buffered rows ('build_time'), formatting ('format_time'), writing
+        ('write_time'), flushing ('flush_time') and waiting for
+        ``max_bytes_per_second`` ('throttle_time'), the achieved
+        'throughput' in bytes per second, from the start of the first write
+        to the end of the latest, and, for streams, the current
+        'batch_size'.
+        '''
+        stats = {key: dict(stats) for key, stats in self._stats.items()}
+        for key, key_stats in stats.items():
+            first, last = self._write_span.get(key, (0., 0.))
+            key_stats['throughput'] = (key_stats['bytes'] / (last - first)
+                                       if last > first else None)
+        return stats
+
+    def __call__(self, name, doc, validate=False):
+        if self._hooks['on_progress']:
+            self._progress.documents += 1
+            if time.monotonic() >= self._progress.next_report:
+                self._report_progress()
+        if self._profiler is None:
+            return super().__call__(name, doc, validate)
+        self._call_start = time.perf_counter()
+        self._profiler.enable()
+        try:
+            return super().__call__(name, doc, validate)
+        finally:
+            self._profiler.disable()
+            if self._call_start is not None:
+                self._profile_time += time.perf_counter() - self._call_start
+                self._call_start = None
+
+    def register_hook(self, name, callback):
+        '''Register a callback, fired as files are written.
+
+        The hooks, and the arguments their callbacks are called with, are:
+
+        * 'on_file_open': ``(key, filename)`` when a ".csv" file is created.
+        * 'on_page': ``(key, rows, bytes, elapsed)`` after each batch of rows
+          is formatted and written, which took ``elapsed`` seconds.
+        * 'on_flush': ``(key,)`` after a file is flushed.
+        * 'on_close': ``(artifacts,)`` once all the files are closed.
+        * 'on_progress': ``(report,)`` at most every ``progress_interval``
+          seconds, and once more when closing, with ``report['done']`` True.
+          See ``progress_report`` for its content.
+
+        The ``key`` names the output a file belongs to. It is the stream name
+        for the file of a stream, and otherwise:
+
+        * 'merged' for the merged file;
+        * '{stream_name}.{column}' for the file of a column, with the 'field'
+          ``layout``;
+        * '{stream_name}.{field}.tidy' for the tidy file of a field;
+        * '{stream_name}.decimated' for the decimated rows of a stream.
+
+        The segments of an output, which start with a schema change, share
+        its key but have their own filename. Exceptions raised by the
+        callbacks are not caught.
+
+        Parameters:
+        -----------
+        name : str
+            One of the hook names above.
+        callback : callable
+        '''
+        if name not in self._hooks:
+            raise ValueError(f"Unknown hook {name!r}. Hooks are "
+                             f"{', '.join(_HOOKS)}.")
+        self._hooks[name].append(callback)
+
+    def expect(self, num_documents=None, num_events=None):
+        '''Set the expected size of the run, to estimate the time left.
+
+        Parameters:
+        -----------
+        num_documents : int, optional
+            The number of documents in the run.
+        num_events : dict, optional
+            Maps stream names to their number of Events, as in the stop
+            document.
+        '''
+        if num_documents is not None:
+            self._progress.num_documents = num_documents
+        if num_events is not None:
+            self._progress.num_events = dict(num_events)
+
+    def progress_report(self):
+        '''Return the progress of the export so far.
+
+        The report is a dict with the 'elapsed' seconds, the 'documents'
+        handled, the expected 'num_documents' (or None), the estimated
+        seconds left 'eta' (or None), whether the export is 'done', and
+        'streams', which maps each stream name to its 'rows', expected
+        'total' (or None), 'rate' in rows per second and 'eta' (or None).
+        '''
+        return self._progress.report(self._closed)
+
+    def _report_progress(self):
+        self._progress.next_report = (time.monotonic()
+                                      + self._progress.interval)
+        report = self.progress_report()
+        for callback in self._hooks['on_progress']:
+            callback(report)
 
     def start(self, doc):
         '''Extracts `start` document information for formatting file_prefix.
@@ -225,6 +1450,71 @@ class Serializer(event_model.DocumentRouter):
         # extract some useful info from the doc
         streamname = doc.get('name')
         self._streamnames[doc['uid']] = streamname
+        # only external fields can be unfilled, most streams have none.
+        self._external[doc['uid']] = tuple(
+            field for field, data_key in doc['data_keys'].items()
+            if data_key.get('external'))
+        self._dtypes[doc['uid']] = {
+            field: _descriptor_dtype(data_key)
+            for field, data_key in doc['data_keys'].items()}
+        self._shapes[doc['uid']] = {
+            field: data_key.get('shape')
+            for field, data_key in doc['data_keys'].items()}
+
+    def event(self, doc):
+        '''Add event document information to a ".csv" file.
+
+        Events are not packed into single-row EventPages, as the
+        DocumentRouter base class would do, but appended directly to the row
+        buffer of their stream. The output is identical to sending the same
+        data as an EventPage.
+
+        Parameters:
+        -----------
+        doc : dict
+            Event document
+        '''
+        external = self._external[doc['descriptor']]
+        if external:
+            filled = doc.get('filled', {})
+            if not all(filled.get(field, True) for field in external):
+                # only pack the event on this rare path, to reuse the error.
+                event_model.verify_filled(event_model.pack_event_page(doc))
+        if self._hooks['on_progress']:
+            self._progress.add(self._streamnames[doc['descriptor']], 1)
+        data = doc['data']
+        fields = self._fields.get(doc['descriptor'])
+        if fields is None or data.keys() != self._seen[doc['descriptor']]:
+            fields = self._classify(doc['descriptor'], data, False)
+            data = self._fill_absent(doc['descriptor'], data, None)
+        if self._tidy and self._tidy_fields[doc['descriptor']]:
+            self._add_tidy(doc['descriptor'], data,
+                           [doc[self._index_key]], [doc['seq_num']], False)
+        if fields:
+            streamname = self._streamnames[doc['descriptor']]
+            buffer = self._get_buffer(streamname, doc['descriptor'])
+            buffer.append(doc['descriptor'], data,
+                          doc[self._index_key], doc['seq_num'])
+            if self._flush or len(buffer) >= buffer.batch_size:
+                self._write(streamname)
+
+    def bulk_events(self, doc):
+        '''Add bulk_events document information to ".csv" files.
+
+        Each Event is routed through ``event`` rather than being repacked into
+        EventPages first.
+
+        Parameters:
+        -----------
+        doc : dict
+            Mapping of EventDescriptor uids to lists of Event documents
+        '''
+        warnings.warn(
+            "The document type 'bulk_events' has been deprecated in favor of "
+            "'event_page', whose structure is a transpose of 'bulk_events'.")
+        for events in doc.values():
+            for event in events:
+                self.event(event)
 
     def event_page(self, doc):
         '''Add event page document information to a ".csv" file.
@@ -234,61 +1524,1342 @@ class Serializer(event_model.DocumentRouter):
 
         .. warning::
 
-            All non 1D 'tabular' data is explicitly ignored.
+            Data which is not 1D 'tabular' is ignored, unless it is expanded
+            into columns (``flatten_max_width``) or written in long format
+            (``tidy``).
 
         .. note::
 
-            The data in Events might be structured as an Event, an EventPage,
-            or a "bulk event" (deprecated). The DocumentRouter base class takes
-            care of first transforming the other repsentations into an
-            EventPage and then routing them through here, so no further action
-            is required in this class. We can assume we will always receive an
-            EventPage.
+            Events and "bulk events" (deprecated) are handled by ``event`` and
+            ``bulk_events``, which share the same per-stream row buffer, so
+            the output does not depend on how the data was structured.
 
         Parameters:
         -----------
         doc : dict
             EventPage document
         '''
-        event_model.verify_filled(doc)
-        streamname = self._streamnames[doc['descriptor']]
-        valid_data = {}
-        for field in doc['data']:
-            # check that the data is 1D, if not ignore it
-            if numpy.asarray(doc['data'][field]).ndim == 1:
-                # create a file for this stream and field if required
-                if streamname not in self._files.keys():
-                    filename = (f'{self._templated_file_prefix}'
-                                f'{streamname}.csv')
-                    f = self._manager.open('stream_data', filename, 'xt')
-                    self._files[streamname] = f
-                # add the valid data to the valid_data dict
-                valid_data[field] = doc['data'][field]
-
-        if valid_data:
-            event_data = pandas.DataFrame(
-                valid_data, index=doc[self._kwargs['index_label']])
-            event_data['seq_num'] = doc['seq_num']
-
-            if self._initial_header_kwarg:
-                self._kwargs['header'] = streamname not in self._has_header
-
-            file = self._files[streamname]
-            event_data.to_csv(file, **self._kwargs)
-            if self._flush:
-                file.flush()
-            self._has_header.add(streamname)
+        external = self._external[doc['descriptor']]
+        if external:
+            filled = doc['filled']
+            if not all(all(filled.get(field, ())) for field in external):
+                event_model.verify_filled(doc)
+        if self._hooks['on_progress']:
+            self._progress.add(self._streamnames[doc['descriptor']],
+                               len(doc['seq_num']))
+        data = doc['data']
+        fields = self._fields.get(doc['descriptor'])
+        if fields is None or data.keys() != self._seen[doc['descriptor']]:
+            fields = self._classify(doc['descriptor'], data, True)
+            if fields is None:  # an empty page, there is nothing to write
+                return
+            data = self._fill_absent(doc['descriptor'], data,
+                                     len(doc['seq_num']))
+        if self._tidy and self._tidy_fields[doc['descriptor']]:
+            self._add_tidy(doc['descriptor'], data,
+                           doc[self._index_key], doc['seq_num'], True)
+        if fields:
+            streamname = self._streamnames[doc['descriptor']]
+            buffer = self._get_buffer(streamname, doc['descriptor'])
+            buffer.extend(doc['descriptor'], data,
+                          doc[self._index_key], doc['seq_num'])
+            if self._flush or len(buffer) >= buffer.batch_size:
+                self._write(streamname)
+
+    def _classify(self, descriptor, data, page):
+        '''Find the fields of a descriptor which are written, from its first
+        Event (or EventPage if ``page``), and return them.
+
+        The 'shape' in the descriptor is not always reliable, so the 1D
+        fields are found from the data instead. The vectors to expand into
+        columns are only those whose length agrees with the shape, if given.
+        An EventPage without rows says nothing about the shapes, so it is
+        left to a later document. Fields which only appear in a later
+        document are classified then, and added after the others.
+        '''
+        if page and any(len(value) == 0 for value in data.values()):
+            return self._fields.get(descriptor)
+        seen = self._seen.setdefault(descriptor, set())
+        fields = list(self._fields.get(descriptor, ()))
+        widths = self._widths.setdefault(descriptor, {})
+        tidy = list(self._tidy_fields.get(descriptor, ()))
+        for field, value in data.items():
+            if field in seen:
+                continue
+            seen.add(field)
+            # the shape of the first row, as waveforms may vary in length.
+            shape = numpy.shape(value[0]) if page else numpy.shape(value)
+            if not shape:
+                fields.append(field)
+            elif (len(shape) == 1 and self._flatten_max_width
+                    and 0 < shape[0] <= self._flatten_max_width
+                    and self._shapes[descriptor].get(field) in (
+                        None, [], list(shape))):
+                fields.append(field)
+                widths[field] = shape[0]
+            elif len(shape) == 1 and (self._tidy is True or (
+                    self._tidy and field in self._tidy)):
+                tidy.append(field)
+        self._tidy_fields[descriptor] = tuple(tidy)
+        fields = tuple(fields)
+        if fields != self._fields.setdefault(descriptor, fields):
+            self._fields[descriptor] = fields
+            buffer = self._buffers.get(self._streamnames[descriptor])
+            if buffer is not None:  # its columns are laid out again
+                buffer.layouts.pop(descriptor, None)
+        return fields
+
+    def _fill_absent(self, descriptor, data, num_rows):
+        '''Return the data of an Event (or EventPage of ``num_rows``) with
+        the written fields it lacks filled with NaN.'''
+        absent = [field for field in self._fields[descriptor]
+                  if field not in data]
+        if not absent:
+            return data
+        data = dict(data)
+        widths = self._widths[descriptor]
+        for field in absent:
+            shape = (() if num_rows is None else (num_rows,)) + (
+                (widths[field],) if widths.get(field) else ())
+            data[field] = numpy.full(shape, numpy.nan) if shape else numpy.nan
+        return data
+
+    def _add_tidy(self, descriptor, data, index, seq_num, page):
+        '''Add the waveforms of an Event (or EventPage if ``page``) to the
+        tidy files of their fields.'''
+        streamname = self._streamnames[descriptor]
+        for field in self._tidy_fields[descriptor]:
+            if field not in data:
+                continue
+            key = f'{streamname}.{field}.tidy'
+            buffer = self._tidy_buffers.get(key)
+            if buffer is None:
+                buffer = self._tidy_buffers[key] = _TidyBuffer()
+            buffer.extend(data[field] if page else [data[field]], index,
+                          seq_num)
+            if self._flush or buffer.num_points >= self._tidy_chunk_size:
+                self._write_tidy(key)
+
+    def _write_tidy(self, key):
+        '''Write the buffered waveforms of a tidy file, in bounded chunks.'''
+        buffer = self._tidy_buffers.pop(key, None)
+        if not buffer:
+            return
+        for frame in buffer.to_frames(self._tidy_chunk_size):
+            self._write_file(key, frame, 'tidy_data')
+
+    def _get_buffer(self, streamname, descriptor):
+        '''Return the row buffer of a stream, ready to accept the rows of the
+        ``descriptor`` uid.
+
+        Every stream has a schema: the 1D fields of all of its descriptors,
+        in the order they were first seen. The rows of descriptors with only
+        some of these fields share the buffer, their other columns filled with
+        NaN. A descriptor with new fields extends the schema, so any pending
+        rows are written out first.
+        '''
+        buffer = self._buffers.get(streamname)
+        if buffer is not None and descriptor in buffer.layouts:
+            return buffer
+        fields = self._fields[descriptor]
+        schema = self._schemas.get(streamname, ())
+        new = tuple(field for field in fields if field not in schema)
+        if new:
+            schema = self._schemas[streamname] = schema + new
+        dtypes = self._stream_dtypes.setdefault(streamname, {})
+        widths = self._stream_widths.setdefault(streamname, {})
+        for field in new:
+            dtypes[field] = self._dtypes[descriptor].get(field)
+            widths[field] = self._widths[descriptor].get(field, 0)
+        if buffer is None or buffer.fields != schema:
+            if buffer is not None:
+                self._write(streamname)
+            buffer = self._buffers[streamname] = _StreamBuffer(
+                schema, tuple(dtypes[field] for field in schema),
+                tuple(widths[field] for field in schema))
+            buffer.batch_size = self._stats.get(streamname, {}).get(
+                'batch_size', self._batch_size)
+        buffer.add_layout(descriptor, fields)
+        return buffer
+
+    def _write(self, streamname):
+        '''Write the buffered rows of a stream to its ".csv" file.
+
+        The file is created if required.
+        '''
+        buffer = self._buffers.pop(streamname, None)
+        if not buffer:
+            return
+        t0 = time.perf_counter()
+        frame = buffer.to_frame()
+        build_time = time.perf_counter() - t0
+        decimator = self._decimators.get(streamname)
+        if decimator is not None:
+            self._write_stream(f'{streamname}.decimated', decimator(frame),
+                               'decimated_data')
+        transform = self._transforms.get(streamname)
+        if transform is not None:
+            t1 = time.perf_counter()
+            frame = transform(frame)
+            build_time += time.perf_counter() - t1
+        self._write_stream(streamname, frame)
+        stats = self._stats.get(streamname)
+        if stats is None:
+            stats = self._stats[streamname] = self._new_stats()
+        stats['build_time'] += build_time
+        stats['batch_size'] = buffer.batch_size
+        if self._target_latency is not None:
+            latency = time.perf_counter() - t0
+            # the rows that would have taken target_latency at the same rate
+            ideal = len(buffer) * self._target_latency / max(latency, 1e-9)
+            batch_size = min(max(ideal, buffer.batch_size / 2),
+                             buffer.batch_size * 2)
+            stats['batch_size'] = int(min(max(batch_size, 1),
+                                          100 * self._batch_size))
+
+    def _write_stream(self, streamname, frame, label='stream_data'):
+        '''Write rows of a stream to its ".csv" file, and to the merge.
+        '''
+        if not len(frame):
+            return
+        if self._layout == 'field':
+            for field in frame.columns.drop('seq_num'):
+                self._write_file(f'{streamname}.{field}',
+                                 frame[[field, 'seq_num']], label)
+        else:
+            self._write_file(streamname, frame, label)
+        if self._column_stats is not None and label == 'stream_data':
+            if streamname not in self._column_stats:
+                self._column_stats[streamname] = _ColumnStats(
+                    self._index_key)
+            self._column_stats[streamname].update(frame)
+        if self._binary_cache:
+            if streamname not in self._caches:
+                self._caches[streamname] = _BinaryCache(
+                    self._manager,
+                    f'{self._templated_file_prefix}{streamname}.cache',
+                    self._index_key, self._throttle)
+            self._caches[streamname].append(frame)
+        if self._merger is not None and streamname in self._merger.streamnames:
+            self._merger.add(streamname, frame)
+            self._write_merged(self._merger.pop())
+
+    def _write_merged(self, frame):
+        '''Write rows merged from several streams to the "merged.csv" file.
+        '''
+        if frame is None:
+            return
+        self._write_file('merged', frame, 'merged_data')
+
+    def _write_file(self, key, frame, label):
+        '''Write rows to the ".csv" file of ``key``, creating it if required.
+
+        The columns of a file are fixed by its header. Rows with only some of
+        them are filled with NaN, while rows with new columns start a new
+        segment, "<key>.<n>.csv", with an updated header, so that the rows
+        already written never need to be rewritten.
+        '''
+        columns = tuple(frame.columns)
+        header = self._headers.get(key)
+        file = self._files.get(key)
+        if header is not None and columns != header:
+            if set(columns) <= set(header):
+                frame = frame.reindex(columns=list(header))
+            else:
+                file = None
+        first = file is None
+        if first:
+            segment = self._segments[key] = self._segments.get(key, -1) + 1
+            file = self._files[key] = self._open(
+                key, label, f'{key}.{segment}' if segment else key)
+            self._headers[key] = columns
+        self._write_frame(key, file, frame, first)
+
+    def _open(self, key, label, name=None):
+        '''Create the ".csv" file of ``key``, named after ``name`` if given.
+        '''
+        filename = f'{self._templated_file_prefix}{name or key}.csv'
+        file = self._manager.open(label, filename, 'xt')
+        if self._checksum is not None:
+            self._hashes[filename] = hashlib.new(self._checksum)
+            self._filenames[key] = filename
+        previous = self._files.get(key)
+        if previous is not None:  # the previous segment is complete.
+            preallocator = self._preallocators.pop(key, None)
+            if preallocator is not None:
+                preallocator.close()
+            _close_early(previous)
+            if self._promoter is not None:
+                self._promoter.start([Path(previous.name)])
+        if self._preallocate:
+            self._preallocators[key] = _Preallocator(file, self._preallocate)
+        for callback in self._hooks['on_file_open']:
+            callback(key, filename)
+        return file
+
+    def _write_frame(self, key, file, frame, first):
+        '''Format ``frame`` as csv and write it to ``file``.
+
+        The header is only written with the ``first`` frame of each file. The
+        statistics are recorded under ``key``.
+        '''
+        if self._initial_header_kwarg:
+            self._kwargs['header'] = first
+        t0 = time.perf_counter()
+        text = frame.to_csv(None, **self._kwargs)
+        encoding = getattr(file, 'encoding', None) or 'utf-8'
+        tee = isinstance(file, _TeeFile)
+        if tee or self._hashes or not (
+                text.isascii() and _ascii_superset(encoding)):
+            # encoded once, for the checksum and the destinations of a tee.
+            data = text.encode(encoding, getattr(file, 'errors', None)
+                               or 'strict')
+            num_bytes = len(data)
+            if self._hashes:
+                self._hashes[self._filenames[key]].update(data)
+        else:  # one byte per character
+            num_bytes = len(text)
+        t1 = time.perf_counter()
+        throttle_time = 0.
+        if self._throttle is not None:
+            throttle_time = self._throttle.consume(num_bytes)
+        if self._preallocators:
+            self._preallocators[key].reserve(num_bytes)
+        file.write(data if tee else text)
+        t2 = time.perf_counter()
+        if self._flush:
+            file.flush()
+            for callback in self._hooks['on_flush']:
+                callback(key)
+        t3 = time.perf_counter()
+        self._write_span.setdefault(key, [t0, t3])[1] = t3
+
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = self._stats[key] = self._new_stats()
+        stats['rows'] += len(frame)
+        stats['bytes'] += num_bytes
+        stats['writes'] += 1
+        stats['format_time'] += t1 - t0
+        stats['throttle_time'] += throttle_time
+        stats['write_time'] += t2 - t1 - throttle_time
+        stats['flush_time'] += t3 - t2
+        for callback in self._hooks['on_page']:
+            callback(key, len(frame), num_bytes, t3 - t0)
+
+    @staticmethod
+    def _new_stats():
+        return {'rows': 0, 'bytes': 0, 'writes': 0, 'build_time': 0.,
+                'format_time': 0., 'write_time': 0., 'flush_time': 0.,
+                'throttle_time': 0.}
+
+    def _write_profile(self):
+        '''Write the profiling report and the raw profile.'''
+        self._profiler.disable()
+        total = self._profile_time
+        if self._call_start is not None:
+            total += time.perf_counter() - self._call_start
+            self._call_start = None
+        phases = {phase: sum(stats[f'{phase}_time']
+                             for stats in self._stats.values())
+                  for phase in ('build', 'format', 'write', 'flush')}
+        phases = {'classify and buffer': total - sum(phases.values()),
+                  'build frames': phases['build'],
+                  'format': phases['format'], 'write': phases['write'],
+                  'flush': phases['flush']}
+
+        report = io.StringIO()
+        report.write(f'{"phase":<20} {"seconds":>10} {"share":>7}\n')
+        for phase, seconds in phases.items():
+            report.write(f'{phase:<20} {seconds:>10.4f} '
+                         f'{seconds / (total or 1):>7.1%}\n')
+        report.write(f'{"total":<20} {total:>10.4f}\n\n')
+        stats = pstats.Stats(self._profiler, stream=report)
+        stats.sort_stats('cumulative').print_stats(30)
+        self._profiler.create_stats()
+        raw = marshal.dumps(self._profiler.stats)
+
+        if self._profile is True:
+            prefix = self._templated_file_prefix
+            self._manager.open('profile', f'{prefix}profile.txt',
+                               'xt').write(report.getvalue())
+            self._manager.open('profile', f'{prefix}profile.prof',
+                               'xb').write(raw)
+        else:
+            Path(self._profile).write_text(report.getvalue())
+            Path(f'{self._profile}.prof').write_bytes(raw)
 
     def stop(self, doc):
+        if doc.get('num_events'):
+            self.expect(num_events=doc['num_events'])
         self.close()
 
     def close(self):
-        '''Close all of the files opened by this Serializer.
+        '''Write any buffered rows and close all of the files opened by this
+        Serializer.
         '''
+        # ``stop`` closes the Serializer, and so does leaving a ``with`` block.
+        if self._closed:
+            return
+        for streamname in list(self._buffers):
+            self._write(streamname)
+        for key in list(self._tidy_buffers):
+            self._write_tidy(key)
+        for streamname, decimator in self._decimators.items():
+            self._write_stream(f'{streamname}.decimated', decimator.finish(),
+                               'decimated_data')
+        for streamname, transform in self._transforms.items():
+            self._write_stream(streamname, transform.finish())
+        if self._merger is not None:
+            self._write_merged(self._merger.pop(final=True))
+        for cache in self._caches.values():
+            cache.close()
+        for preallocator in self._preallocators.values():
+            preallocator.close()
+        if self._profiler is not None:
+            self._write_profile()
+        if self._checksum is not None:
+            file = self._manager.open(
+                'checksums',
+                f'{self._templated_file_prefix}checksums.{self._checksum}',
+                'xt')
+            file.writelines(f'{digest}  {filename}\n'
+                            for filename, digest in self.checksums.items())
+        if self._column_stats is not None:
+            file = self._manager.open(
+                'column_stats',
+                f'{self._templated_file_prefix}column_stats.json', 'xt')
+            json.dump(self.column_stats, file, indent=2)
         self._manager.close()
+        self._closed = True
+        if self._hooks['on_progress']:
+            self._report_progress()
+        if self._promoter is not None:
+            self._promoter.start([name for names in
+                                  self._manager.artifacts.values()
+                                  for name in names])
+        for callback in self._hooks['on_close']:
+            callback(self.artifacts)
 
     def __enter__(self):
         return self
 
     def __exit__(self, *exception_details):
         self.close()
+
+
+_HOOKS = ('on_file_open', 'on_page', 'on_flush', 'on_close', 'on_progress')
+
+
+def _ascii_superset(encoding):
+    '''Whether ``encoding`` encodes ASCII text as one byte per character.'''
+    return codecs.lookup(encoding).name in _ASCII_SUPERSETS
+
+
+_ASCII_SUPERSETS = {'ascii', 'utf-8', 'iso8859-1', 'cp1252'}
+
+
+_JSON_DTYPES = {'integer': numpy.dtype('int64'),
+                'boolean': numpy.dtype('bool')}
+
+
+def _descriptor_dtype(data_key):
+    '''Return the ``numpy.dtype`` of a data key, or None to infer it.
+
+    The numpy ``dtype_str`` is used if given, otherwise only the JSON schema
+    types 'integer' and 'boolean' are precise enough: 'number' can be either
+    integer or floating point, so it is left to the data.
+    '''
+    dtype_str = data_key.get('dtype_str')
+    if dtype_str:
+        try:
+            dtype = numpy.dtype(dtype_str)
+        except TypeError:
+            pass
+        else:
+            if dtype.kind in 'biuf':
+                return dtype
+    return _JSON_DTYPES.get(data_key.get('dtype'))
+
+
+def _typed_column(values, dtype):
+    '''Convert a list of values into an array of ``dtype``, where possible.
+
+    Missing values (None or NaN) in integer and boolean columns give the
+    pandas nullable 'Int64' or 'boolean' arrays. Values which do not fit
+    ``dtype`` (e.g. a fractional value in an integer column, or one out of
+    its range) are never truncated: the dtype is inferred from the data
+    instead.
+    '''
+    array = numpy.asarray(values)
+    if dtype is None or array.dtype == dtype:
+        return array
+    kind = array.dtype.kind
+    if dtype.kind == 'f':
+        if kind in 'biuf':
+            return _lossless_astype(array, dtype)
+        if kind == 'O':
+            try:
+                return array.astype(dtype)
+            except (TypeError, ValueError):
+                pass
+    elif dtype.kind in 'iu':
+        if kind in 'iu':
+            return _lossless_astype(array, dtype)
+        if kind in 'fO':
+            nullable = ('Int' if dtype.kind == 'i' else 'UInt') + str(
+                dtype.itemsize * 8)
+            try:
+                return pandas.array(values, dtype=nullable)
+            except (OverflowError, TypeError, ValueError):
+                pass
+    elif kind == 'O':  # boolean with missing values
+        try:
+            return pandas.array(values, dtype='boolean')
+        except (TypeError, ValueError):
+            pass
+    return array
+
+
+def _lossless_astype(array, dtype):
+    '''Return ``array`` converted to ``dtype`` if no value changes, otherwise
+    ``array`` itself.'''
+    # numpy deems int64 to float64 safe, though it rounds beyond 2**53.
+    if numpy.can_cast(array.dtype, dtype, 'safe') and (
+            dtype.kind != 'f' or array.dtype.kind == 'f'
+            or array.dtype.itemsize < dtype.itemsize):
+        return array.astype(dtype)
+    with numpy.errstate(over='ignore', invalid='ignore'):
+        converted = array.astype(dtype)
+        restored = converted.astype(array.dtype)
+    if numpy.all((restored == array) | (array != array)):  # NaN is kept
+        return converted
+    return array
+
+
+def _numeric_values(column):
+    '''Return the values of a numeric column as a ``numpy.ndarray``.
+
+    Nullable integer and boolean columns are returned as floating point, with
+    NaN for the missing values, any other column as it is.
+    '''
+    if pandas.api.types.is_extension_array_dtype(column.dtype):
+        try:
+            return column.to_numpy(dtype=float, na_value=numpy.nan)
+        except (TypeError, ValueError):
+            pass
+    return column.to_numpy()
+
+
+class _StreamBuffer:
+    """
+    Column-wise buffer of the rows of one stream waiting to be written.
+
+    Parameters
+    ----------
+    fields : tuple
+        The 1D fields of the stream, in column order.
+    dtypes : tuple
+        The ``numpy.dtype`` of each field, or None to infer it from the data.
+    widths : tuple
+        The length of the vector of each field which is expanded into
+        columns, or 0 for a scalar field.
+    """
+    __slots__ = ('fields', 'dtypes', 'widths', 'columns', 'layouts', 'index',
+                 'seq_num', 'batch_size')
+
+    def __init__(self, fields, dtypes, widths):
+        self.fields = fields
+        self.dtypes = dtypes
+        self.widths = widths
+        self.batch_size = None  # the rows to buffer before writing
+        # the values of scalar fields, the arrays of rows of vector fields
+        self.columns = [[] for _ in fields]
+        # maps descriptor uids to their (column, field) pairs and the columns
+        # they have no data for, for the scalar fields and then the vector
+        # fields, which have (column, field, width) and (column, width).
+        self.layouts = {}
+        self.index = []
+        self.seq_num = []
+
+    def __len__(self):
+        return len(self.seq_num)
+
+    def add_layout(self, descriptor, fields):
+        '''Accept the rows of the ``descriptor`` uid, which has ``fields``.'''
+        columns = list(zip(self.columns, self.fields, self.widths))
+        self.layouts[descriptor] = (
+            [(column, field) for column, field, width in columns
+             if not width and field in fields],
+            [column for column, field, width in columns
+             if not width and field not in fields],
+            [(column, field, width) for column, field, width in columns
+             if width and field in fields],
+            [(column, width) for column, field, width in columns
+             if width and field not in fields])
+
+    def append(self, descriptor, data, index, seq_num):
+        '''Append the row of a single Event.'''
+        present, missing, vectors, missing_vectors = self.layouts[descriptor]
+        for column, field in present:
+            column.append(data[field])
+        for column in missing:
+            column.append(numpy.nan)
+        for column, field, width in vectors:
+            column.append(self._rows(field, data[field], width))
+        for column, width in missing_vectors:
+            column.append(numpy.full((1, width), numpy.nan))
+        self.index.append(index)
+        self.seq_num.append(seq_num)
+
+    def extend(self, descriptor, data, index, seq_num):
+        '''Append the rows of an EventPage.'''
+        present, missing, vectors, missing_vectors = self.layouts[descriptor]
+        for column, field in present:
+            column.extend(data[field])
+        if missing:
+            nans = [numpy.nan] * len(seq_num)
+            for column in missing:
+                column.extend(nans)
+        for column, field, width in vectors:
+            column.append(self._rows(field, data[field], width))
+        for column, width in missing_vectors:
+            column.append(numpy.full((len(seq_num), width), numpy.nan))
+        self.index.extend(index)
+        self.seq_num.extend(seq_num)
+
+    @staticmethod
+    def _rows(field, values, width):
+        '''Return the vector(s) ``values`` as an array of rows.'''
+        rows = numpy.asarray(values)
+        if rows.ndim not in (1, 2) or rows.shape[-1] != width:
+            raise ValueError(f"The values of the field {field!r} must be "
+                             f"vectors of length {width}, as in its first "
+                             f"Event, to be expanded into columns.")
+        return rows.reshape(-1, width)
+
+    def to_frame(self):
+        '''Return the buffered rows as a ``pandas.DataFrame``.
+
+        Each column is converted once into a typed array, so that integer
+        columns stay integer (even with missing values) and the formatting
+        of numeric columns does not go through Python objects.
+        '''
+        columns = {}
+        for field, column, dtype, width in zip(self.fields, self.columns,
+                                               self.dtypes, self.widths):
+            if not width:
+                columns[field] = _typed_column(column, dtype)
+                continue
+            rows = numpy.concatenate(column)
+            for i in range(width):
+                columns[f'{field}_{i}'] = _typed_column(rows[:, i], dtype)
+        frame = pandas.DataFrame(columns, index=self.index)
+        frame['seq_num'] = self.seq_num
+        return frame
+
+
+class _TidyBuffer:
+    """
+    Buffer of the waveforms of one field, written in long format.
+
+    The rows of the long format are only built when writing, with one
+    ``numpy.repeat`` per column over all of the buffered waveforms.
+    """
+    __slots__ = ('values', 'lengths', 'index', 'seq_num', 'num_points')
+
+    def __init__(self):
+        self.values = []  # flat arrays of the points of the waveforms
+        self.lengths = []  # arrays of the number of points per waveform
+        self.index = []
+        self.seq_num = []
+        self.num_points = 0
+
+    def __len__(self):
+        return self.num_points
+
+    def extend(self, waveforms, index, seq_num):
+        '''Append the waveforms of the rows of an EventPage.'''
+        if isinstance(waveforms, numpy.ndarray) and waveforms.ndim == 2:
+            lengths = numpy.full(len(waveforms), waveforms.shape[1])
+            values = waveforms.ravel()
+        else:
+            lengths = numpy.fromiter(map(len, waveforms), int,
+                                     len(waveforms))
+            values = (numpy.concatenate(waveforms) if len(waveforms)
+                      else numpy.empty(0))
+        self.values.append(values)
+        self.lengths.append(lengths)
+        self.index.extend(index)
+        self.seq_num.extend(seq_num)
+        self.num_points += len(values)
+
+    def to_frames(self, chunk_size):
+        '''Yield the points as DataFrames of at most ``chunk_size`` rows.'''
+        values = numpy.concatenate(self.values)
+        lengths = numpy.concatenate(self.lengths)
+        starts = numpy.cumsum(lengths) - lengths
+        index = numpy.repeat(numpy.asarray(self.index), lengths)
+        seq_num = numpy.repeat(numpy.asarray(self.seq_num), lengths)
+        # the position of each point within its waveform.
+        position = numpy.arange(len(values)) - numpy.repeat(starts, lengths)
+        for start in range(0, len(values), chunk_size):
+            chunk = slice(start, start + chunk_size)
+            yield pandas.DataFrame({'seq_num': seq_num[chunk],
+                                    'index': position[chunk],
+                                    'value': values[chunk]},
+                                   index=index[chunk])
+
+
+class _Merger:
+    """
+    Streaming as-of merge of the rows of several streams on their index.
+
+    Rows of each stream are held back until every stream has rows pending,
+    and then merged up to the earliest of their latest times, so that a row
+    is only emitted once no earlier row can arrive. To bound memory, all
+    pending rows are merged once there are more than ``window`` of them.
+
+    Parameters
+    ----------
+    streamnames : iterable of str
+        The streams to merge, in column order.
+    window : int
+        The maximum number of rows to hold back.
+    """
+    def __init__(self, streamnames, window):
+        self.streamnames = tuple(streamnames)
+        self.window = window
+        self._pending = {streamname: [] for streamname in self.streamnames}
+        self._num_pending = 0
+        self._columns = None
+        self._last = None  # the last merged row, to forward fill from
+
+    def add(self, streamname, frame):
+        '''Add the next rows of a stream.'''
+        frame = frame.drop(columns='seq_num').add_prefix(f'{streamname}.')
+        self._pending[streamname].append(frame)
+        self._num_pending += len(frame)
+
+    def pop(self, final=False):
+        '''Return the rows which can be merged now, or None.
+
+        If ``final`` is True, all the pending rows are merged.
+        '''
+        if not self._num_pending:
+            return None
+        if final or self._num_pending > self.window:
+            watermark = None
+        elif all(self._pending.values()):
+            watermark = min(frames[-1].index[-1]
+                            for frames in self._pending.values())
+        else:
+            return None
+
+        ready = []
+        for streamname, frames in self._pending.items():
+            if not frames:
+                continue
+            frame = pandas.concat(frames) if len(frames) > 1 else frames[0]
+            if watermark is None:
+                split = len(frame)
+            else:
+                split = numpy.searchsorted(frame.index, watermark, 'right')
+            ready.append(frame.iloc[:split])
+            self._pending[streamname] = [frame.iloc[split:]] if split < len(
+                frame) else []
+            self._num_pending -= split
+
+        # a stable sort keeps the order of the streams for equal times.
+        merged = pandas.concat(ready).sort_index(kind='mergesort')
+        if self._columns is None:
+            self._columns = merged.columns
+        else:
+            # columns which appear later are added at the end.
+            self._columns = self._columns.append(
+                merged.columns[~merged.columns.isin(self._columns)])
+        merged = merged.reindex(columns=self._columns)
+        if self._last is not None:
+            merged = pandas.concat([self._last, merged]).ffill().iloc[1:]
+        else:
+            merged = merged.ffill()
+        self._last = merged.iloc[-1:]
+        return merged
+
+
+class _Resampler:
+    """
+    Aggregates the rows of a stream into buckets of a fixed time period.
+
+    The rows of the last bucket seen are held back, as the next rows may
+    still fall into it, until ``finish`` is called.
+
+    Parameters
+    ----------
+    period : float
+        The bucket width, in the units of the index (seconds).
+    method : {'mean', 'last', 'min', 'max'}
+        How the numeric values in each bucket are aggregated. Missing (NaN)
+        values are skipped, as by pandas, so a bucket is only empty if all of
+        its values are missing.
+    """
+    _ufuncs = {'min': numpy.fmin, 'max': numpy.fmax}
+
+    def __init__(self, period, method):
+        if not period > 0:
+            raise ValueError(f"The resample period must be positive, not "
+                             f"{period!r}.")
+        if method not in ('mean', 'last', 'min', 'max'):
+            raise ValueError(f"The resample_method must be one of 'mean', "
+                             f"'last', 'min' or 'max', not {method!r}.")
+        self.period = period
+        self.method = method
+        self._pending = None
+
+    def __call__(self, frame):
+        '''Return the buckets completed by the rows in ``frame``.'''
+        if self._pending is not None:
+            frame = pandas.concat([self._pending, frame])
+        buckets = self._buckets(frame)
+        starts = numpy.flatnonzero(buckets[1:] != buckets[:-1]) + 1
+        split = starts[-1] if len(starts) else 0
+        self._pending = frame.iloc[split:]
+        return self._aggregate(frame.iloc[:split], buckets[:split])
+
+    def finish(self):
+        '''Return the last, possibly incomplete, bucket.'''
+        frame, self._pending = self._pending, None
+        if frame is None:
+            return pandas.DataFrame()
+        return self._aggregate(frame, self._buckets(frame))
+
+    def _buckets(self, frame):
+        return numpy.floor_divide(frame.index.to_numpy(dtype=float),
+                                  self.period)
+
+    def _aggregate(self, frame, buckets):
+        if not len(frame):
+            return frame
+        starts = numpy.flatnonzero(
+            numpy.r_[True, buckets[1:] != buckets[:-1]])
+        ends = numpy.r_[starts[1:], len(buckets)]
+        aggregated = {}
+        for field, column in frame.items():
+            values = _numeric_values(column)
+            kind = values.dtype.kind
+            if field == 'seq_num' or kind not in 'biuf':
+                aggregated[field] = values[ends - 1]
+            elif self.method in self._ufuncs:
+                aggregated[field] = self._ufuncs[self.method].reduceat(
+                    values, starts)
+            elif kind != 'f':  # no missing values
+                aggregated[field] = (
+                    values[ends - 1] if self.method == 'last' else
+                    numpy.add.reduceat(values.astype(float), starts)
+                    / (ends - starts))
+            elif self.method == 'last':
+                valid = numpy.where(numpy.isnan(values), -1,
+                                    numpy.arange(len(values)))
+                last = numpy.maximum.reduceat(valid, starts)
+                aggregated[field] = numpy.where(last >= 0, values[last],
+                                                numpy.nan)
+            else:
+                valid = ~numpy.isnan(values)
+                sums = numpy.add.reduceat(numpy.where(valid, values, 0.),
+                                          starts)
+                counts = numpy.add.reduceat(valid.astype(int), starts)
+                with numpy.errstate(invalid='ignore'):
+                    aggregated[field] = sums / counts
+        return pandas.DataFrame(aggregated,
+                                index=buckets[starts] * self.period)
+
+
+class _Decimator:
+    """
+    Reduces the rows of a stream by a fixed factor.
+
+    Windows of ``factor`` rows are counted from the first row of the stream,
+    so they do not depend on how the rows are batched. The rows of an
+    incomplete window are held back until the next call or ``finish``.
+
+    Parameters
+    ----------
+    factor : int
+        The number of rows per window.
+    method : {'nth', 'envelope'}
+        Keep the first row of each window, or its minimum and maximum.
+    """
+    def __init__(self, factor, method):
+        if not (isinstance(factor, int) and factor > 0):
+            raise ValueError(f"The decimation factor must be a positive "
+                             f"integer, not {factor!r}.")
+        if method not in ('nth', 'envelope'):
+            raise ValueError(f"The decimate_method must be one of 'nth' or "
+                             f"'envelope', not {method!r}.")
+        self.factor = factor
+        self.method = method
+        self._num_rows = 0  # rows seen by the 'nth' method
+        self._pending = None  # rows of an incomplete 'envelope' window
+
+    def __call__(self, frame):
+        '''Return the decimated rows of the complete windows.'''
+        if self.method == 'nth':
+            offset = -self._num_rows % self.factor
+            self._num_rows += len(frame)
+            return frame.iloc[offset::self.factor]
+        if self._pending is not None:
+            frame = pandas.concat([self._pending, frame])
+        split = len(frame) - len(frame) % self.factor
+        self._pending = frame.iloc[split:]
+        return self._envelope(frame.iloc[:split])
+
+    def finish(self):
+        '''Return the decimated rows of the last, incomplete, window.'''
+        frame, self._pending = self._pending, None
+        if frame is None or not len(frame):
+            return pandas.DataFrame()
+        return self._envelope(frame, len(frame))
+
+    def _envelope(self, frame, factor=None):
+        factor = factor or self.factor
+        firsts = frame.iloc[::factor]
+        envelope = {}
+        for field, column in frame.items():
+            values = _numeric_values(column)
+            if field == 'seq_num' or values.dtype.kind not in 'biuf':
+                envelope[field] = firsts[field].to_numpy()
+            else:
+                # one reshape per page, windows along the second axis.
+                windows = values.reshape(-1, factor)
+                envelope[f'{field}_min'] = numpy.fmin.reduce(windows, axis=1)
+                envelope[f'{field}_max'] = numpy.fmax.reduce(windows, axis=1)
+        envelope = pandas.DataFrame(envelope, index=firsts.index)
+        # keep 'seq_num' as the last column, as in the full output
+        return envelope[[column for column in envelope if column != 'seq_num']
+                        + ['seq_num']]
+
+
+class _BinaryCache:
+    """
+    Columnar binary copy of the numeric columns written for a stream.
+
+    Each column is appended to a ".npy" file as rows are written. The
+    header of each file reserves room for the final shape, which is only
+    filled in, along with a "manifest.json", by ``close``. Columns which
+    are missing from some rows are padded with NaN.
+
+    Parameters
+    ----------
+    manager : Manager
+        The manager used to open the files.
+    directory : str
+        The postfix of the directory holding the files.
+    index_label : str
+        The name given to the index column.
+    throttle : _TokenBucket or None
+        Limits the rate at which the columns are written.
+    """
+    _HEADER_SIZE = 128  # bytes reserved for the header of each ".npy" file
+
+    def __init__(self, manager, directory, index_label, throttle=None):
+        self._manager = manager
+        self._throttle = throttle
+        self._directory = directory
+        self._index_label = index_label
+        self._columns = {}  # maps names to (file name, dtype, file handle)
+        self._skipped = set()  # names of the non-numeric columns
+        self._length = 0
+
+    def append(self, frame):
+        '''Append the numeric columns of ``frame``.'''
+        columns = {self._index_label: frame.index.to_numpy(),
+                   **{name: _numeric_values(column)
+                      for name, column in frame.items()}}
+        for name in self._columns.keys() - columns.keys():
+            columns[name] = numpy.full(len(frame), numpy.nan)
+        for name, values in columns.items():
+            if name in self._skipped:
+                continue
+            if name not in self._columns:
+                if values.dtype.kind not in 'biuf':
+                    self._skipped.add(name)
+                    continue
+                self._add_column(name)
+            _, dtype, file = self._columns[name]
+            data = numpy.ascontiguousarray(values, dtype).tobytes()
+            if self._throttle is not None:
+                self._throttle.consume(len(data))
+            file.write(data)
+        self._length += len(frame)
+
+    def _add_column(self, name):
+        dtype = numpy.dtype('<i8' if name == 'seq_num' else '<f8')
+        filename = f'{len(self._columns)}.npy'
+        file = self._manager.open('binary_cache',
+                                  f'{self._directory}/{filename}', 'xb')
+        file.write(self._header(dtype, self._length))
+        # pad the rows written before this column appeared.
+        file.write(numpy.full(self._length, numpy.nan, dtype).tobytes())
+        self._columns[name] = (filename, dtype, file)
+
+    def _header(self, dtype, length):
+        header = repr({'descr': numpy.lib.format.dtype_to_descr(dtype),
+                       'fortran_order': False, 'shape': (length,)})
+        header = header.ljust(self._HEADER_SIZE - 11) + '\n'
+        return (numpy.lib.format.magic(1, 0) + struct.pack('<H', len(header))
+                + header.encode('latin1'))
+
+    def close(self):
+        '''Write the final shape of each column and the manifest.'''
+        manifest = {'index': self._index_label, 'length': self._length,
+                    'columns': [], 'skipped': sorted(self._skipped)}
+        for name, (filename, dtype, file) in self._columns.items():
+            file.seek(0)
+            file.write(self._header(dtype, self._length))
+            file.seek(0, 2)
+            manifest['columns'].append(
+                {'name': name, 'file': filename, 'dtype': dtype.str})
+        # the manager closes the files, along with all the others.
+        file = self._manager.open('binary_cache',
+                                  f'{self._directory}/manifest.json', 'xt')
+        json.dump(manifest, file, indent=2)
+
+
+class _ColumnStats:
+    """
+    Running statistics of the numeric columns of a stream.
+
+    Each page is reduced along its columns at once, and merged into the
+    totals with the pairwise update of Chan et al., which stays accurate
+    where the naive sum of squares would cancel.
+
+    Parameters
+    ----------
+    index_label : str
+        The name of the index column.
+    """
+    def __init__(self, index_label):
+        self._index_label = index_label
+        self._names = []
+        self._skipped = set()  # names of the non-numeric columns
+        self._count = numpy.zeros(0)
+        self._nan_count = numpy.zeros(0)
+        self._min = numpy.zeros(0)
+        self._max = numpy.zeros(0)
+        self._mean = numpy.zeros(0)
+        self._m2 = numpy.zeros(0)  # sum of squared deviations from the mean
+
+    def update(self, frame):
+        '''Add the rows of ``frame``.'''
+        columns = {self._index_label: frame.index.to_numpy(),
+                   **{name: _numeric_values(column)
+                      for name, column in frame.items()}}
+        for name, values in columns.items():
+            if (name not in self._names and name not in self._skipped
+                    and values.dtype.kind not in 'biuf'):
+                self._skipped.add(name)
+        new = [name for name in columns
+               if name not in self._names and name not in self._skipped]
+        if new:
+            self._names.extend(new)
+            pad = numpy.zeros(len(new))
+            self._count = numpy.r_[self._count, pad]
+            self._nan_count = numpy.r_[self._nan_count, pad]
+            self._min = numpy.r_[self._min, pad + numpy.nan]
+            self._max = numpy.r_[self._max, pad + numpy.nan]
+            self._mean = numpy.r_[self._mean, pad]
+            self._m2 = numpy.r_[self._m2, pad]
+        if not self._names:
+            return
+        # columns missing from this page only count as NaN.
+        nans = numpy.full(len(frame), numpy.nan)
+        values = numpy.column_stack(
+            [columns.get(name, nans).astype(float) for name in self._names])
+        valid = ~numpy.isnan(values)
+        count = valid.sum(axis=0)
+        mean = numpy.divide(numpy.where(valid, values, 0).sum(axis=0), count,
+                            out=numpy.zeros(len(count)), where=count > 0)
+        m2 = (numpy.where(valid, values - mean, 0) ** 2).sum(axis=0)
+
+        total = self._count + count
+        delta = mean - self._mean
+        ratio = numpy.divide(count, total, out=numpy.zeros(len(count)),
+                             where=total > 0)
+        self._mean += delta * ratio
+        self._m2 += m2 + delta ** 2 * self._count * ratio
+        self._count = total
+        self._nan_count += len(frame) - count
+        self._min = numpy.fmin(self._min, numpy.fmin.reduce(values, axis=0))
+        self._max = numpy.fmax(self._max, numpy.fmax.reduce(values, axis=0))
+
+    def to_dict(self):
+        '''Return the statistics of each column, with None for undefined.'''
+        def value(x):
+            return None if numpy.isnan(x) else float(x)
+
+        return {name: {'count': int(count), 'nan_count': int(nan_count),
+                       'min': value(min_), 'max': value(max_),
+                       'mean': value(mean) if count else None,
+                       'variance': value(m2 / count) if count else None}
+                for name, count, nan_count, min_, max_, mean, m2
+                in zip(self._names, self._count, self._nan_count, self._min,
+                       self._max, self._mean, self._m2)}
+
+
+class _Progress:
+    """
+    Counts the documents and the rows of each stream for progress reports.
+
+    Parameters
+    ----------
+    interval : float
+        The minimum number of seconds between reports.
+    """
+    def __init__(self, interval):
+        self.interval = interval
+        self.start = None
+        self.next_report = 0.  # the first document starts the clock
+        self.documents = 0
+        self.num_documents = None
+        self.num_events = None
+        self.rows = {}
+
+    def add(self, streamname, rows):
+        '''Count the rows of an Event or EventPage.'''
+        self.rows[streamname] = self.rows.get(streamname, 0) + rows
+
+    def report(self, done=False):
+        '''Return the report described by ``Serializer.progress_report``.'''
+        now = time.monotonic()
+        if self.start is None:
+            self.start = now
+        elapsed = now - self.start
+        num_events = self.num_events or {}
+        streams = {}
+        for streamname in {**self.rows, **num_events}:
+            rows = self.rows.get(streamname, 0)
+            total = num_events.get(streamname)
+            rate = rows / elapsed if elapsed else 0.
+            eta = None
+            if total is not None and rate:
+                eta = max(total - rows, 0) / rate
+            streams[streamname] = {'rows': rows, 'total': total,
+                                   'rate': rate, 'eta': eta}
+        # the time left is estimated from the rows if possible.
+        eta = None
+        if done:
+            eta = 0.
+        elif num_events and elapsed:
+            rows = sum(self.rows.values())
+            if rows:
+                eta = max(sum(num_events.values()) - rows, 0) * elapsed / rows
+        elif self.num_documents and self.documents and elapsed:
+            eta = (max(self.num_documents - self.documents, 0) * elapsed
+                   / self.documents)
+        return {'elapsed': elapsed, 'documents': self.documents,
+                'num_documents': self.num_documents, 'eta': eta,
+                'done': done, 'streams': streams}
+
+
+class _ProgressRenderer:
+    """
+    Shows progress reports on a single line of a console.
+
+    Parameters
+    ----------
+    file : file-like
+        Where to write, usually ``sys.stderr``.
+    """
+    def __init__(self, file):
+        self._file = file
+        self._width = 0
+
+    def __call__(self, report):
+        parts = []
+        for streamname, stream in report['streams'].items():
+            total = stream['total']
+            rows = (f"{stream['rows']}/{total}" if total is not None
+                    else str(stream['rows']))
+            parts.append(f"{streamname} {rows} ({stream['rate']:.0f} rows/s)")
+        if report['done']:
+            parts.append(f"done in {report['elapsed']:.1f}s")
+        elif report['eta'] is not None:
+            parts.append(f"ETA {report['eta']:.0f}s")
+        line = ', '.join(parts)
+        # pad with spaces to clear the end of a longer previous line.
+        self._file.write('\r' + line.ljust(self._width))
+        self._width = len(line)
+        if report['done']:
+            self._file.write('\n')
+        self._file.flush()
+
+
+class _Preallocator:
+    """
+    Reserves the space of a file ahead of its writes, in growing extents.
+
+    Parameters
+    ----------
+    file : file-like
+        A file on disk, written sequentially from its start.
+    extent : int
+        The bytes of the first extent. Each next extent is as large as the
+        space reserved so far, up to ``MAX_EXTENT``.
+    """
+    MAX_EXTENT = 2**30
+
+    def __init__(self, file, extent):
+        self._file = file
+        self._extent = extent
+        self._record = Path(f'{file.name}.length')
+        self._length = 0  # the bytes written
+        self._reserved = 0
+        self._record.write_text('0')
+
+    def reserve(self, num_bytes):
+        '''Make room for the next ``num_bytes``, before they are written.'''
+        self._length += num_bytes
+        if self._length <= self._reserved or self._extent is None:
+            return
+        # the data written so far is on disk before the file is extended, so
+        # that the recorded length is a safe place to look for its end.
+        self._file.flush()
+        self._record.write_text(str(self._length - num_bytes))
+        try:
+            while self._reserved < self._length:
+                extent = min(max(self._extent, self._reserved),
+                             self.MAX_EXTENT)
+                os.posix_fallocate(self._file.fileno(), self._reserved, extent)
+                self._reserved += extent
+        except OSError as error:
+            warnings.warn(f"Preallocating {self._file.name} failed, the rest "
+                          f"of it is written without: {error}")
+            self._extent = None
+
+    def close(self):
+        '''Truncate the file to the length of its data.'''
+        self._file.flush()
+        os.ftruncate(self._file.fileno(), self._length)
+        self._record.unlink()
+
+
+class _TokenBucket:
+    """
+    Limits the average rate of writes, allowing bursts.
+
+    Parameters
+    ----------
+    rate : float
+        The tokens (bytes) added per second.
+    burst : float or None
+        The maximum number of tokens held, ``rate`` if None.
+    """
+    def __init__(self, rate, burst=None):
+        if not rate > 0:
+            raise ValueError(f"max_bytes_per_second must be positive, not "
+                             f"{rate!r}.")
+        self.rate = rate
+        self.burst = rate if burst is None else burst
+        self._tokens = self.burst
+        self._time = time.monotonic()
+
+    def consume(self, tokens):
+        '''Take ``tokens``, sleeping until they are available.
+
+        Returns the seconds slept.
+        '''
+        now = time.monotonic()
+        self._tokens = min(self.burst,
+                           self._tokens + (now - self._time) * self.rate)
+        self._time = now
+        # the bucket may go into debt, which the sleep pays back.
+        self._tokens -= tokens
+        if self._tokens >= 0:
+            return 0.
+        wait = -self._tokens / self.rate
+        time.sleep(wait)
+        return wait
+
+
+def _close_early(file):
+    '''Close a file of a manager before the manager is closed.
+
+    The managers of suitcase.utils close all of their files again when they
+    are closed, and the size tracking of their file handles fails on a
+    closed file, so the handle is closed only once here.
+    '''
+    file.close()
+    file.close = lambda: None
+
+
+class _Promoter:
+    """
+    Moves files from a staging directory to their final directory, in
+    background threads.
+
+    Each file is moved once, as soon as it is complete: the segments of a
+    stream as they are rotated out, the other files on close.
+
+    Parameters
+    ----------
+    staging_directory : str or Path
+        The directory the files are written to.
+    directory : str or Path
+        The directory the files are moved to, keeping their relative paths.
+    """
+    def __init__(self, staging_directory, directory):
+        self.staging_directory = Path(staging_directory).expanduser().resolve()
+        self.directory = Path(directory).expanduser().resolve()
+        self.promoted = {}  # maps staged paths to final paths
+        self._started = set()  # the staged paths being, or already, moved
+        self._threads = []
+        self._error = None
+
+    def start(self, names):
+        '''Start moving the files ``names`` which are not moved already.'''
+        names = [name for name in names if name not in self._started]
+        if not names:
+            return
+        self._started.update(names)
+        thread = threading.Thread(target=self._promote, args=(names,),
+                                  name='suitcase.csv promoter')
+        self._threads.append(thread)
+        thread.start()
+
+    def wait(self, timeout=None):
+        '''Wait for the files to be moved, re-raising any error.'''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(None if deadline is None
+                        else max(deadline - time.monotonic(), 0))
+        if self._error is not None:
+            raise self._error
+
+    def _promote(self, names):
+        try:
+            for name in names:
+                final = self.directory / name.relative_to(
+                    self.staging_directory)
+                if final.exists():
+                    raise FileExistsError(f"Cannot move {name} to {final}, "
+                                          f"which already exists.")
+                final.parent.mkdir(parents=True, exist_ok=True)
+                # copy then rename, so the final file is never incomplete.
+                partial = final.with_name(final.name + '.part')
+                shutil.copyfile(name, partial)
+                size = os.path.getsize(name)
+                if os.path.getsize(partial) != size:
+                    raise OSError(f"The copy of {name} to {partial} has "
+                                  f"{os.path.getsize(partial)} bytes "
+                                  f"rather than {size}.")
+                os.replace(partial, final)
+                os.remove(name)
+                if name.parent != self.staging_directory:
+                    try:
+                        name.parent.rmdir()
+                    except OSError:  # not empty, or removed by another
+                        pass
+                self.promoted[name] = final
+        except Exception as error:
+            if self._error is None:
+                self._error = error
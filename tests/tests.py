@@ -1,7 +1,21 @@
-from suitcase.csv import export
+from suitcase.csv import (export, load_binary_cache, MultiRunSerializer,
+                          recover_preallocated, Serializer, TeeManager,
+                          ZipArchiveManager)
 import event_model
+import gzip
+import hashlib
+import io
+import itertools
+import json
+import lzma
 import numpy
 import pandas
+import pstats
+import pytest
+import suitcase.utils
+import threading
+import time
+import zipfile
 
 
 def create_expected(collector):
@@ -51,6 +65,97 @@ def create_expected(collector):
     return expected
 
 
+def synthetic_documents(num_events=10, fields=('x', 'y'), page_size=None,
+                        stream_names=('primary',)):
+    '''yields the documents of a run with scalar data in every stream.
+
+    Each stream gets ``num_events`` rows, emitted as single Events if
+    ``page_size`` is None or as EventPages of up to ``page_size`` rows. The
+    n-th stream is offset in time by n/4 s and the streams are interleaved.
+    '''
+    run_bundle = event_model.compose_run()
+    yield 'start', run_bundle.start_doc
+    data_keys = {field: {'source': 'synthetic', 'dtype': 'number',
+                         'shape': []} for field in fields}
+    desc_bundles = []
+    for stream_name in stream_names:
+        desc_bundle = run_bundle.compose_descriptor(data_keys=data_keys,
+                                                    name=stream_name)
+        yield 'descriptor', desc_bundle.descriptor_doc
+        desc_bundles.append(desc_bundle)
+
+    step = page_size or 1
+    for first in range(0, num_events, step):
+        page = range(first, min(first + step, num_events))
+        for n, desc_bundle in enumerate(desc_bundles):
+            rows = [{field: i * (j + 1) * 0.5 + n
+                     for j, field in enumerate(fields)} for i in page]
+            times = [1000. + i + n / 4 for i in page]
+            if page_size is None:
+                yield 'event', desc_bundle.compose_event(
+                    data=rows[0], timestamps=rows[0], seq_num=first + 1,
+                    time=times[0])
+            else:
+                data = {field: [row[field] for row in rows]
+                        for field in fields}
+                yield 'event_page', desc_bundle.compose_event_page(
+                    data=data, timestamps=data,
+                    seq_num=[i + 1 for i in page], time=times)
+    yield 'stop', run_bundle.compose_stop()
+
+
+def documents_for(data_keys, rows, event_type, **kwargs):
+    '''returns the documents of a run with the ``rows`` in a 'primary' stream.
+
+    ``data_keys`` are those of the descriptor, or a list of them for several
+    descriptors, and each row goes to the descriptor with its fields, or the
+    only one. Row i has the time i and seq_num i + 1. With the
+    ``event_type`` 'event_page', consecutive rows of a descriptor with the
+    same fields are packed into one EventPage. The ``kwargs`` are passed to
+    ``compose_event``.
+    '''
+    if isinstance(data_keys, dict):
+        data_keys = [data_keys]
+    run_bundle = event_model.compose_run()
+    documents = [('start', run_bundle.start_doc)]
+    desc_bundles = []
+    for keys in data_keys:
+        # event_model no longer composes streams of descriptors with
+        # different fields, but older runs have them.
+        desc_bundle = run_bundle.compose_descriptor(
+            data_keys=keys, name='primary', validate=len(data_keys) == 1)
+        documents.append(('descriptor', desc_bundle.descriptor_doc))
+        desc_bundles.append(desc_bundle)
+
+    events = []
+    for i, row in enumerate(rows):
+        desc_bundle, = (desc_bundles if len(desc_bundles) == 1 else
+                        [desc_bundle for desc_bundle, keys
+                         in zip(desc_bundles, data_keys)
+                         if set(keys) == set(row)])
+        events.append(desc_bundle.compose_event(
+            data=row, timestamps={field: 0 for field in row}, seq_num=i + 1,
+            time=float(i), **kwargs))
+    if event_type == 'event':
+        documents.extend(('event', event) for event in events)
+    else:
+        for _, page in itertools.groupby(
+                events, lambda event: (event['descriptor'],
+                                       tuple(event['data']))):
+            documents.append(('event_page',
+                              event_model.pack_event_page(*page)))
+    documents.append(('stop', run_bundle.compose_stop()))
+    return documents
+
+
+def export_to_memory(documents, **kwargs):
+    '''exports to memory buffers and returns ``{filename: text}``.'''
+    manager = suitcase.utils.MemoryBuffersManager()
+    export(documents, manager, file_prefix='', **kwargs)
+    return {artifact['postfix']: artifact['handle'].getvalue()
+            for artifact in manager.get_artifacts('stream_data')}
+
+
 def test_export(tmp_path, example_data):
     ''' runs a test using the `example_data` pytest.fixture.
 
@@ -100,3 +205,723 @@ def test_file_prefix_formatting(file_prefix_list, example_data, tmp_path):
         unique_actual = set(str(artifact).split('/')[-1].partition('-')[0]
                             for artifact in artifacts['stream_data'])
         assert unique_actual == set([templated_file_prefix])
+
+
+@pytest.mark.parametrize('page_size', [None, 1, 4])
+@pytest.mark.parametrize('batch_size', [1, 3, 1000])
+def test_event_and_event_page_output_match(page_size, batch_size):
+    '''Events, EventPages and any batch size produce identical files.'''
+    expected = export_to_memory(synthetic_documents(page_size=10))
+    actual = export_to_memory(synthetic_documents(page_size=page_size),
+                              batch_size=batch_size)
+    assert actual == expected
+
+
+@pytest.mark.parametrize('event_type', ['event', 'event_page'])
+@pytest.mark.parametrize('filled', [True, False])
+def test_unfilled_external_data(event_type, filled):
+    '''Only unfilled external fields raise ``UnfilledData``.'''
+    data_keys = {'x': {'source': 'synthetic', 'dtype': 'number', 'shape': []},
+                 'img': {'source': 'synthetic', 'dtype': 'array',
+                         'shape': [2, 2], 'external': 'FILESTORE:'}}
+    rows = [{'x': 1., 'img': numpy.ones((2, 2)) if filled else 'datum-id'}]
+    documents = documents_for(data_keys, rows, event_type,
+                              filled={'img': filled})
+
+    if filled:
+        assert list(export_to_memory(documents)) == ['primary.csv']
+    else:
+        with pytest.raises(event_model.UnfilledData):
+            export_to_memory(documents)
+
+
+def test_empty_first_event_page():
+    '''An empty EventPage does not decide which fields are written.'''
+    data_keys = {'x': {'source': 'synthetic', 'dtype': 'number', 'shape': []},
+                 'img': {'source': 'synthetic', 'dtype': 'array',
+                         'shape': [2, 2]}}
+    rows = [{'x': 1., 'img': numpy.ones((2, 2))}]
+    documents = documents_for(data_keys, rows, 'event')
+    descriptor = documents[1][1]
+    empty_page = {'descriptor': descriptor['uid'], 'uid': [], 'time': [],
+                  'seq_num': [], 'data': {'x': [], 'img': []},
+                  'timestamps': {'x': [], 'img': []}, 'filled': {}}
+    documents.insert(2, ('event_page', empty_page))
+    assert export_to_memory(documents)['primary.csv'].splitlines() == [
+        'time,x,seq_num', '0.0,1.0,1']
+
+
+@pytest.mark.parametrize('event_type', ['event', 'event_page'])
+def test_typed_columns(event_type):
+    '''Columns keep the descriptor dtype, also with missing values.'''
+    data_keys = {'count': {'source': 'synthetic', 'dtype': 'integer',
+                           'shape': []},
+                 'flag': {'source': 'synthetic', 'dtype': 'boolean',
+                          'shape': []},
+                 'level': {'source': 'synthetic', 'dtype': 'number',
+                           'dtype_str': '<f8', 'shape': []}}
+    rows = [{'count': 1, 'flag': True, 'level': 2},
+            {'count': None, 'flag': None, 'level': 3},
+            {'count': 3., 'flag': False, 'level': None}]
+    documents = documents_for(data_keys, rows, event_type)
+
+    actual = export_to_memory(documents)['primary.csv']
+    assert actual.splitlines() == ['time,count,flag,level,seq_num',
+                                   '0.0,1,True,2.0,1',
+                                   '1.0,,,3.0,2',
+                                   '2.0,3,False,,3']
+
+
+@pytest.mark.parametrize('event_type', ['event', 'event_page'])
+def test_typed_columns_out_of_range(event_type):
+    '''Values which do not fit the descriptor dtype are written as they are.
+    '''
+    data_keys = {'short': {'source': 'synthetic', 'dtype': 'integer',
+                           'dtype_str': '<i2', 'shape': []},
+                 'unsigned': {'source': 'synthetic', 'dtype': 'integer',
+                              'dtype_str': '<u4', 'shape': []},
+                 'big': {'source': 'synthetic', 'dtype': 'integer',
+                         'dtype_str': '<f8', 'shape': []},
+                 'sparse': {'source': 'synthetic', 'dtype': 'integer',
+                            'dtype_str': '<i2', 'shape': []}}
+    rows = [{'short': 100000, 'unsigned': -1, 'big': 2**53 + 1,
+             'sparse': 100000},
+            {'short': 1, 'unsigned': 1, 'big': 1, 'sparse': None}]
+    documents = documents_for(data_keys, rows, event_type)
+
+    actual = export_to_memory(documents)['primary.csv']
+    assert actual.splitlines() == [
+        'time,short,unsigned,big,sparse,seq_num',
+        '0.0,100000,-1,9007199254740993,100000,1',
+        '1.0,1,1,1,,2']
+
+
+@pytest.mark.parametrize('event_type', ['event', 'event_page'])
+def test_schema_changes(event_type):
+    '''Descriptors of one stream with different fields share its columns.
+
+    Missing columns are left empty, and new columns start a new segment.
+    '''
+    data_keys = [{field: {'source': 'synthetic', 'dtype': 'number',
+                          'shape': []} for field in fields}
+                 for fields in ['xy', 'x', 'xz']]
+    rows = [{field: i + 0.5 for field in fields}
+            for i, fields in enumerate(['xy', 'x', 'xy', 'xz', 'x'])]
+    documents = documents_for(data_keys, rows, event_type)
+
+    actual = export_to_memory(documents, batch_size=2)
+    assert actual['primary.csv'].splitlines() == ['time,x,y,seq_num',
+                                                  '0.0,0.5,0.5,1',
+                                                  '1.0,1.5,,2',
+                                                  '2.0,2.5,2.5,3']
+    assert actual['primary.1.csv'].splitlines() == ['time,x,y,z,seq_num',
+                                                    '3.0,3.5,,3.5,4',
+                                                    '4.0,4.5,,,5']
+
+
+@pytest.mark.parametrize('event_type', ['event', 'event_page'])
+def test_sparse_fields(event_type):
+    '''Fields absent from some Events of a descriptor are left empty, and
+    fields which only appear later start a new segment.'''
+    data_keys = {field: {'source': 'synthetic', 'dtype': 'number',
+                         'shape': []} for field in 'xy'}
+    rows = [{field: i + 0.5 for field in fields}
+            for i, fields in enumerate(['xy', 'x', 'xyz', 'xz'])]
+    documents = documents_for(data_keys, rows, event_type, validate=False)
+
+    actual = export_to_memory(documents)
+    assert actual['primary.csv'].splitlines() == ['time,x,y,seq_num',
+                                                  '0.0,0.5,0.5,1',
+                                                  '1.0,1.5,,2']
+    assert actual['primary.1.csv'].splitlines() == ['time,x,y,z,seq_num',
+                                                    '2.0,2.5,2.5,2.5,3',
+                                                    '3.0,3.5,,3.5,4']
+
+
+@pytest.mark.parametrize('event_type', ['event', 'event_page'])
+def test_flatten_max_width(event_type):
+    '''Short vectors are expanded into columns, longer ones are ignored.'''
+    data_keys = {'x': {'source': 'synthetic', 'dtype': 'number', 'shape': []},
+                 'quad': {'source': 'synthetic', 'dtype': 'array',
+                          'shape': [4]},
+                 'spectrum': {'source': 'synthetic', 'dtype': 'array',
+                              'shape': [20]}}
+    rows = [{'x': i, 'quad': numpy.arange(4) + 10 * i,
+             'spectrum': numpy.ones(20)} for i in range(3)]
+    documents = documents_for(data_keys, rows, event_type)
+
+    actual = export_to_memory(documents, flatten_max_width=8)['primary.csv']
+    assert actual.splitlines() == [
+        'time,x,quad_0,quad_1,quad_2,quad_3,seq_num',
+        '0.0,0,0,1,2,3,1',
+        '1.0,1,10,11,12,13,2',
+        '2.0,2,20,21,22,23,3']
+    assert export_to_memory(documents)['primary.csv'].splitlines()[0] == (
+        'time,x,seq_num')
+
+
+@pytest.mark.parametrize('event_type', ['event', 'event_page'])
+@pytest.mark.parametrize('tidy_chunk_size', [2, 65536])
+def test_tidy(event_type, tidy_chunk_size):
+    '''Waveforms of varying length are written in long format.'''
+    data_keys = {'x': {'source': 'synthetic', 'dtype': 'number', 'shape': []},
+                 'wave': {'source': 'synthetic', 'dtype': 'array',
+                          'shape': [-1]}}
+    rows = [{'x': i, 'wave': numpy.arange(i + 1) * 0.5} for i in range(3)]
+    documents = documents_for(data_keys, rows, event_type)
+
+    manager = suitcase.utils.MemoryBuffersManager()
+    export(documents, manager, file_prefix='', tidy=['wave'],
+           tidy_chunk_size=tidy_chunk_size)
+    actual = {artifact['postfix']: artifact['handle'].getvalue()
+              for artifact in manager.get_artifacts('tidy_data')}
+    assert actual['primary.wave.tidy.csv'].splitlines() == [
+        'time,seq_num,index,value',
+        '0.0,1,0,0.0',
+        '1.0,2,0,0.0',
+        '1.0,2,1,0.5',
+        '2.0,3,0,0.0',
+        '2.0,3,1,0.5',
+        '2.0,3,2,1.0']
+
+
+def test_field_layout():
+    '''Each field is written to its own file, with time and seq_num.'''
+    documents = list(synthetic_documents(
+        num_events=10, page_size=3, stream_names=('primary', 'baseline')))
+    expected = export_to_memory(documents)
+    actual = export_to_memory(documents, layout='field')
+    assert sorted(actual) == ['baseline.x.csv', 'baseline.y.csv',
+                              'primary.x.csv', 'primary.y.csv']
+    for streamname in ('primary', 'baseline'):
+        frame = pandas.read_csv(io.StringIO(expected[f'{streamname}.csv']))
+        for field in ('x', 'y'):
+            pandas.testing.assert_frame_equal(
+                pandas.read_csv(io.StringIO(
+                    actual[f'{streamname}.{field}.csv'])),
+                frame[['time', field, 'seq_num']])
+    with pytest.raises(ValueError):
+        Serializer(suitcase.utils.MemoryBuffersManager(), layout='column')
+
+
+@pytest.mark.parametrize('merge_window', [4, 10000])
+@pytest.mark.parametrize('page_size', [None, 3])
+def test_merge(tmp_path, merge_window, page_size):
+    '''The merged file matches an as-of merge of the stream files.'''
+    streams = ('primary', 'baseline', 'monitor')
+    documents = synthetic_documents(page_size=page_size, stream_names=streams)
+    artifacts = export(documents, tmp_path, file_prefix='', batch_size=2,
+                       merge=('primary', 'monitor'),
+                       merge_window=merge_window)
+
+    frames = [pandas.read_csv(tmp_path / f'{stream}.csv', index_col='time')
+              .drop(columns='seq_num').add_prefix(f'{stream}.')
+              for stream in ('primary', 'monitor')]
+    expected = pandas.concat(frames).sort_index(kind='mergesort').ffill()
+    actual = pandas.read_csv(artifacts['merged_data'][0], index_col='time')
+    pandas.testing.assert_frame_equal(actual, expected)
+
+
+def test_merge_late_stream(tmp_path):
+    '''The columns of a stream whose rows start after some rows are merged
+    start a new segment.'''
+    streams = ('primary', 'monitor')
+    documents = list(synthetic_documents(stream_names=streams))
+    monitor, = (doc['uid'] for name, doc in documents
+                if name == 'descriptor' and doc['name'] == 'monitor')
+    # the monitor starts after the first 3 rows of primary.
+    documents = [(name, doc) for name, doc in documents
+                 if name != 'event' or doc['descriptor'] != monitor
+                 or doc['seq_num'] > 3]
+    artifacts = export(documents, tmp_path, file_prefix='', batch_size=2,
+                       merge=streams, merge_window=2)
+
+    assert [name.name for name in artifacts['merged_data']] == [
+        'merged.csv', 'merged.1.csv']
+    first, second = (pandas.read_csv(name, index_col='time')
+                     for name in artifacts['merged_data'])
+    assert list(first.columns) == ['primary.x', 'primary.y']
+    assert list(second.columns) == ['primary.x', 'primary.y', 'monitor.x',
+                                    'monitor.y']
+    frames = [pandas.read_csv(tmp_path / f'{stream}.csv', index_col='time')
+              .drop(columns='seq_num').add_prefix(f'{stream}.')
+              for stream in streams]
+    expected = pandas.concat(frames).sort_index(kind='mergesort').ffill()
+    pandas.testing.assert_frame_equal(pandas.concat([first, second]),
+                                      expected)
+
+
+@pytest.mark.parametrize('method', ['mean', 'last', 'min', 'max'])
+@pytest.mark.parametrize('page_size', [None, 3])
+def test_resample(tmp_path, method, page_size):
+    '''Resampled rows match a groupby on the buckets of the raw rows, also
+    with missing values.'''
+    documents = list(synthetic_documents(num_events=20, page_size=page_size,
+                                         stream_names=('primary', 'monitor')))
+    # y is missing from some rows of the monitor, and from all of a bucket.
+    monitor, = (doc['uid'] for name, doc in documents
+                if name == 'descriptor' and doc['name'] == 'monitor')
+    for name, doc in documents:
+        if name.startswith('event') and doc['descriptor'] == monitor:
+            doc['data'] = dict(doc['data'], y=numpy.where(
+                (numpy.asarray(doc['seq_num']) % 2 == 0)
+                | (numpy.abs(numpy.asarray(doc['seq_num']) - 12) < 3),
+                numpy.nan, doc['data']['y']))
+            if name == 'event':
+                doc['data']['y'] = doc['data']['y'].item()
+    export(documents, tmp_path / 'raw', file_prefix='')
+    export(documents, tmp_path, file_prefix='', batch_size=4,
+           resample={'monitor': 3}, resample_method=method)
+
+    raw = pandas.read_csv(tmp_path / 'raw' / 'monitor.csv', index_col='time')
+    expected = raw.groupby(raw.index // 3 * 3).agg(
+        {'x': method, 'y': method, 'seq_num': 'last'})
+    expected.index.name = 'time'
+    actual = pandas.read_csv(tmp_path / 'monitor.csv', index_col='time')
+    pandas.testing.assert_frame_equal(actual, expected, check_dtype=False)
+    # other streams are not resampled
+    assert (tmp_path / 'primary.csv').read_text() == (
+        tmp_path / 'raw' / 'primary.csv').read_text()
+
+
+@pytest.mark.parametrize('method', ['nth', 'envelope'])
+@pytest.mark.parametrize('alongside', [True, False])
+def test_decimate(tmp_path, method, alongside):
+    '''Decimated rows do not depend on how the rows are batched.'''
+    documents = list(synthetic_documents(num_events=20, page_size=3,
+                                         stream_names=('primary', 'flyer')))
+    export(documents, tmp_path / 'raw', file_prefix='')
+    artifacts = export(documents, tmp_path, file_prefix='', batch_size=4,
+                       decimate={'flyer': 3}, decimate_method=method,
+                       decimate_alongside=alongside)
+
+    raw = pandas.read_csv(tmp_path / 'raw' / 'flyer.csv', index_col='time')
+    if method == 'nth':
+        expected = raw.iloc[::3]
+    else:
+        windows = raw.reset_index().groupby(numpy.arange(len(raw)) // 3)
+        expected = windows.agg(time=('time', 'first'), x_min=('x', 'min'),
+                               x_max=('x', 'max'), y_min=('y', 'min'),
+                               y_max=('y', 'max'),
+                               seq_num=('seq_num', 'first'))
+        expected = expected.set_index('time')
+    if alongside:
+        assert artifacts['decimated_data'] == [
+            tmp_path / 'flyer.decimated.csv']
+        assert (tmp_path / 'flyer.csv').read_text() == (
+            tmp_path / 'raw' / 'flyer.csv').read_text()
+    actual = pandas.read_csv(artifacts.get('decimated_data', [
+        tmp_path / 'flyer.csv'])[0], index_col='time')
+    pandas.testing.assert_frame_equal(actual, expected)
+
+
+def test_binary_cache(tmp_path):
+    '''The binary cache loads the same numeric data as the csv file.'''
+    documents = synthetic_documents(num_events=20, page_size=3,
+                                    stream_names=('primary', 'baseline'))
+    artifacts = export(documents, tmp_path, file_prefix='', batch_size=4,
+                       binary_cache=True)
+    assert tmp_path / 'primary.cache' / 'manifest.json' in (
+        artifacts['binary_cache'])
+
+    for stream in ('primary', 'baseline'):
+        expected = pandas.read_csv(tmp_path / f'{stream}.csv',
+                                   index_col='time')
+        actual = load_binary_cache(tmp_path / f'{stream}.cache')
+        base = actual['x'].to_numpy()
+        while base is not None and not isinstance(base, numpy.memmap):
+            base = base.base
+        assert base is not None  # backed by a memory map
+        pandas.testing.assert_frame_equal(actual, expected)
+        # the ".npy" files can also be loaded on their own
+        assert len(numpy.load(tmp_path / f'{stream}.cache' / '0.npy')) == 20
+
+
+@pytest.mark.parametrize('target_latency', [1e-9, 1e3])
+def test_adaptive_batch_size(target_latency):
+    '''The batch size shrinks for slow writes and grows for fast ones.'''
+    serializer = Serializer(suitcase.utils.MemoryBuffersManager(),
+                            batch_size=8, target_latency=target_latency)
+    for name, doc in synthetic_documents(num_events=200):
+        serializer(name, doc)
+    stats = serializer.stats['primary']
+    assert stats['rows'] == 200
+    assert stats['bytes'] == len(
+        serializer.artifacts['stream_data'][0].getvalue())
+    if target_latency < 1:
+        assert stats['batch_size'] == 1
+    else:
+        # doubled after each of the writes of 8, 16, 32, 64 and 80 rows
+        assert stats['batch_size'] == 256
+        assert stats['writes'] == 5
+
+
+def test_hooks():
+    '''Hooks fire for file creation, each batch, flushes and close.'''
+    calls = []
+    serializer = Serializer(
+        suitcase.utils.MemoryBuffersManager(), file_prefix='', flush=True,
+        merge=('primary', 'baseline'),
+        hooks={'on_file_open': lambda *args: calls.append(('open', *args)),
+               'on_flush': lambda *args: calls.append(('flush', *args))})
+    serializer.register_hook('on_page',
+                             lambda *args: calls.append(('page', *args)))
+    serializer.register_hook('on_close',
+                             lambda *args: calls.append(('close', *args)))
+    with pytest.raises(ValueError):
+        serializer.register_hook('on_nothing', print)
+    for name, doc in synthetic_documents(
+            num_events=3, page_size=3, stream_names=('primary', 'baseline')):
+        serializer(name, doc)
+
+    opened = [call[1:] for call in calls if call[0] == 'open']
+    assert opened == [('primary', 'primary.csv'),
+                      ('baseline', 'baseline.csv'), ('merged', 'merged.csv')]
+    pages = [call[1:3] for call in calls if call[0] == 'page']
+    # the last merged row waits for more rows of 'primary', until close.
+    assert pages == [('primary', 3), ('baseline', 3), ('merged', 5),
+                     ('merged', 1)]
+    assert sum(call[3] for call in calls if call[0] == 'page') == sum(
+        len(handle.getvalue())
+        for handle in serializer.artifacts['stream_data']
+        + serializer.artifacts['merged_data'])
+    assert [call[1] for call in calls if call[0] == 'flush'] == [
+        'primary', 'baseline', 'merged', 'merged']
+    assert calls[-1] == ('close', serializer.artifacts)
+
+
+def test_prefetch():
+    '''Prefetched documents are read by another thread, in order.'''
+    threads = set()
+
+    def source(documents):
+        for item in documents:
+            threads.add(threading.current_thread())
+            yield item
+
+    documents = list(synthetic_documents(num_events=50))
+    expected = export_to_memory(documents)
+    assert export_to_memory(source(documents), prefetch=4) == expected
+    assert threading.current_thread() not in threads
+
+    def failing_source():
+        yield from documents[:10]
+        raise ValueError('bad source')
+
+    with pytest.raises(ValueError, match='bad source'):
+        export_to_memory(failing_source(), prefetch=4)
+
+
+def test_progress(capsys):
+    '''Progress reports count rows against the totals of the stop doc.'''
+    documents = list(synthetic_documents(
+        num_events=10, page_size=3, stream_names=('primary', 'baseline')))
+    reports = []
+    export(documents, suitcase.utils.MemoryBuffersManager(),
+           progress=reports.append, progress_interval=0)
+    # one report per document, and a final one.
+    assert len(reports) == len(documents) + 1
+    assert [report['documents'] for report in reports[:3]] == [1, 2, 3]
+    assert all(report['num_documents'] == len(documents)
+               for report in reports)
+    assert reports[-2]['eta'] is not None
+    assert reports[-1]['done'] and reports[-1]['eta'] == 0
+    assert {streamname: (stream['rows'], stream['total'])
+            for streamname, stream in reports[-1]['streams'].items()} == {
+        'primary': (10, 10), 'baseline': (10, 10)}
+
+    export(documents, suitcase.utils.MemoryBuffersManager(), progress=True)
+    output = capsys.readouterr().err
+    assert 'primary 10/10' in output and output.endswith('\n')
+
+
+@pytest.mark.parametrize('to_path', [True, False])
+def test_profile(tmp_path, to_path):
+    '''A profile report and raw profile are written on close.'''
+    profile = tmp_path / 'report.txt' if to_path else True
+    artifacts = export(synthetic_documents(), tmp_path / 'out',
+                       file_prefix='', profile=profile)
+    if to_path:
+        assert 'profile' not in artifacts
+        report, raw = profile, tmp_path / 'report.txt.prof'
+    else:
+        report, raw = artifacts['profile']
+    for phase in ('classify and buffer', 'format', 'write', 'total'):
+        assert phase in report.read_text()
+    assert '(_write_frame)' in report.read_text()
+    # the raw profile can be loaded with pstats
+    assert pstats.Stats(str(raw)).total_calls > 0
+
+
+def test_max_bytes_per_second():
+    '''Writes are rate limited, and the throughput is reported.'''
+    serializer = Serializer(suitcase.utils.MemoryBuffersManager(),
+                            batch_size=10, max_bytes_per_second=20000,
+                            max_burst_bytes=100)
+    t0 = time.monotonic()
+    for name, doc in synthetic_documents(num_events=200):
+        serializer(name, doc)
+    elapsed = time.monotonic() - t0
+    stats = serializer.stats['primary']
+    assert elapsed >= (stats['bytes'] - 100) / 20000
+    assert stats['throttle_time'] > 0
+    assert stats['throughput'] <= 20000 * 1.1
+
+
+def test_staging_directory(tmp_path):
+    '''Files written to the staging directory are moved on close.'''
+    staging, final = tmp_path / 'staging', tmp_path / 'final'
+    documents = list(synthetic_documents(num_events=20, page_size=3,
+                                         stream_names=('primary', 'baseline')))
+    expected = export(documents, tmp_path / 'direct', file_prefix='',
+                      binary_cache=True)
+    artifacts = export(documents, final, file_prefix='', binary_cache=True,
+                       staging_directory=staging)
+
+    assert list(staging.rglob('*')) == []
+    for label, names in expected.items():
+        assert artifacts[label] == [
+            final / name.relative_to(tmp_path / 'direct') for name in names]
+        for name, expected_name in zip(artifacts[label], names):
+            assert name.read_bytes() == expected_name.read_bytes()
+
+
+def test_staging_directory_segments(tmp_path):
+    '''A segment is moved as soon as a new one is started.'''
+    staging, final = tmp_path / 'staging', tmp_path / 'final'
+    data_keys = [{field: {'source': 'synthetic', 'dtype': 'number',
+                          'shape': []} for field in fields}
+                 for fields in ['x', 'xy']]
+    rows = [{field: i + 0.5 for field in fields}
+            for i, fields in enumerate(['x', 'x', 'xy', 'xy'])]
+    documents = documents_for(data_keys, rows, 'event')
+    serializer = Serializer(final, file_prefix='', batch_size=2,
+                            staging_directory=staging, preallocate=1024)
+    for name, doc in documents[:-1]:
+        serializer(name, doc)
+    serializer.wait()
+    assert sorted(path.name for path in staging.iterdir()) == [
+        'primary.1.csv', 'primary.1.csv.length']
+    assert (final / 'primary.csv').read_text().splitlines() == [
+        'time,x,seq_num', '0.0,0.5,1', '1.0,1.5,2']
+
+    serializer('stop', documents[-1][1])
+    serializer.wait()
+    assert list(staging.iterdir()) == []
+    assert serializer.artifacts['stream_data'] == [
+        final / 'primary.csv', final / 'primary.1.csv']
+    assert (final / 'primary.1.csv').read_text().splitlines() == [
+        'time,x,y,seq_num', '2.0,2.5,2.5,3', '3.0,3.5,3.5,4']
+
+
+def test_preallocate(tmp_path):
+    '''Preallocated files are truncated on close, or recovered after a
+    crash.'''
+    documents = list(synthetic_documents(num_events=200))
+    expected = export(documents, tmp_path / 'plain', file_prefix='')
+    actual = export(documents, tmp_path / 'preallocated', file_prefix='',
+                    preallocate=1024, batch_size=10)
+    expected, = expected['stream_data']
+    actual, = actual['stream_data']
+    assert actual.read_text() == expected.read_text()
+    assert sorted(path.name for path in actual.parent.iterdir()) == [
+        'primary.csv']
+
+    # a crash leaves the rest of the last extent filled with NUL bytes.
+    serializer = Serializer(tmp_path / 'crashed', file_prefix='', flush=True,
+                            preallocate=1024)
+    for name, doc in documents[:-1]:
+        serializer(name, doc)
+    crashed = tmp_path / 'crashed' / 'primary.csv'
+    assert crashed.stat().st_size > len(expected.read_bytes())
+    assert recover_preallocated(crashed) == len(expected.read_bytes())
+    assert crashed.read_text() == expected.read_text()
+    assert not (tmp_path / 'crashed' / 'primary.csv.length').exists()
+
+
+@pytest.mark.parametrize('algorithm', ['sha256', 'md5'])
+def test_checksum(tmp_path, algorithm):
+    '''The checksums match those of the files on disk.'''
+    artifacts = export(
+        synthetic_documents(page_size=3, stream_names=('primary', 'baseline')),
+        tmp_path, file_prefix='', batch_size=2, merge=('primary', 'baseline'),
+        checksum=algorithm)
+    lines = artifacts['checksums'][0].read_text().splitlines()
+    assert len(lines) == 3
+    for line in lines:
+        digest, filename = line.split('  ')
+        assert digest == hashlib.new(
+            algorithm, (tmp_path / filename).read_bytes()).hexdigest()
+
+
+@pytest.mark.parametrize('page_size', [None, 3])
+def test_column_stats(tmp_path, page_size):
+    '''The running statistics match those of the written files.'''
+    documents = list(synthetic_documents(num_events=20, page_size=page_size,
+                                         stream_names=('primary', 'baseline')))
+    # give the running update something to cancel: a large offset.
+    for name, doc in documents:
+        if name == 'event':
+            doc['data']['y'] += 1e9
+        elif name == 'event_page':
+            doc['data']['y'] = [y + 1e9 for y in doc['data']['y']]
+    with Serializer(tmp_path, file_prefix='', column_stats=True,
+                    batch_size=4) as serializer:
+        for name, doc in documents:
+            serializer(name, doc)
+    with open(tmp_path / 'column_stats.json') as file:
+        actual = json.load(file)
+    assert actual == serializer.column_stats
+    for streamname in ('primary', 'baseline'):
+        frame = pandas.read_csv(tmp_path / f'{streamname}.csv')
+        assert list(actual[streamname]) == ['time', 'x', 'y', 'seq_num']
+        for column, stats in actual[streamname].items():
+            values = frame[column].to_numpy()
+            assert stats['count'] == len(values)
+            assert stats['nan_count'] == 0
+            assert stats['min'] == values.min()
+            assert stats['max'] == values.max()
+            assert stats['mean'] == pytest.approx(values.mean(), rel=1e-12)
+            assert stats['variance'] == pytest.approx(values.var(), rel=1e-9)
+
+
+@pytest.mark.parametrize('compression', [zipfile.ZIP_STORED,
+                                         zipfile.ZIP_DEFLATED])
+def test_zip_archive_manager(tmp_path, compression):
+    '''The members of the archive match the files of a normal export.'''
+    documents = list(synthetic_documents(
+        num_events=20, page_size=3, stream_names=('primary', 'baseline')))
+    expected = export(documents, tmp_path / 'direct', file_prefix='',
+                      batch_size=4, merge=('primary', 'baseline'),
+                      binary_cache=True)
+    artifacts = export(documents, ZipArchiveManager(tmp_path / 'run.zip',
+                                                    compression),
+                       file_prefix='', batch_size=4,
+                       merge=('primary', 'baseline'), binary_cache=True)
+
+    assert artifacts['archive'] == [tmp_path / 'run.zip']
+    with zipfile.ZipFile(tmp_path / 'run.zip') as archive:
+        assert archive.testzip() is None
+        for label, names in expected.items():
+            members = [str(name.relative_to(tmp_path / 'direct'))
+                       for name in names]
+            assert sorted(artifacts[label]) == sorted(members)
+            for name, member in zip(names, members):
+                assert archive.read(member) == name.read_bytes()
+
+
+def test_zip_archive_manager_stream(tmp_path):
+    '''The chosen file is streamed, and held back files are added as soon as
+    they are closed while nothing is streamed.'''
+    manager = ZipArchiveManager(tmp_path / 'run.zip', stream='primary.csv')
+    baseline = manager.open('stream_data', 'baseline.csv', 'xt')
+    primary = manager.open('stream_data', 'primary.csv', 'xt')
+    baseline.write('baseline\n')
+    primary.write('primary\n')
+    baseline.close()
+    primary.close()  # the held back baseline.csv is added now
+    other = manager.open('stream_data', 'other.csv', 'xt')
+    assert other.buffer is manager._streaming
+    other.write('other\n')
+    manager.close()
+
+    with zipfile.ZipFile(tmp_path / 'run.zip') as archive:
+        assert archive.namelist() == ['primary.csv', 'baseline.csv',
+                                      'other.csv']
+        assert archive.read('baseline.csv') == b'baseline\n'
+        assert archive.read('other.csv') == b'other\n'
+
+
+@pytest.mark.parametrize('tee', [False, True])
+def test_bytes_written(tmp_path, tee):
+    '''The bytes counted are those written, also for non-ASCII text.'''
+    data_keys = {'label': {'source': 'synthetic', 'dtype': 'string',
+                           'shape': []}}
+    rows = [{'label': 'plain'}, {'label': '\u00b5-scan'}, {'label': 'plain'}]
+    directories = [tmp_path / 'a', tmp_path / 'b']
+    with Serializer(directories if tee else directories[0], file_prefix='',
+                    batch_size=1) as serializer:
+        for name, doc in documents_for(data_keys, rows, 'event'):
+            serializer(name, doc)
+
+    content = (tmp_path / 'a' / 'primary.csv').read_bytes()
+    assert '\u00b5-scan'.encode() in content
+    assert serializer.stats['primary']['bytes'] == len(content)
+    if tee:
+        assert (tmp_path / 'b' / 'primary.csv').read_bytes() == content
+
+
+def test_tee_manager(tmp_path):
+    '''Every destination gets the same bytes, compressed if requested.'''
+    documents = list(synthetic_documents(
+        num_events=20, page_size=3, stream_names=('primary', 'baseline')))
+    expected = export(documents, tmp_path / 'direct', file_prefix='',
+                      checksum='sha256')
+    memory = suitcase.utils.MemoryBuffersManager()
+    export(documents, TeeManager(tmp_path / 'plain', memory,
+                                 (tmp_path / 'gzip', 'gzip'),
+                                 (tmp_path / 'xz', 'xz')),
+           file_prefix='', checksum='sha256')
+
+    buffers = {artifact['postfix']: artifact['handle'].getvalue()
+               for artifact in memory.get_artifacts()}
+    for names in expected.values():
+        for name in names:
+            relative = name.relative_to(tmp_path / 'direct')
+            content = name.read_bytes()
+            assert (tmp_path / 'plain' / relative).read_bytes() == content
+            assert buffers[str(relative)] == content
+            assert gzip.decompress((tmp_path / 'gzip' / relative).with_name(
+                relative.name + '.gz').read_bytes()) == content
+            assert lzma.decompress((tmp_path / 'xz' / relative).with_name(
+                relative.name + '.xz').read_bytes()) == content
+
+
+@pytest.mark.parametrize('max_open_files', [None, 1])
+def test_multi_run_serializer(tmp_path, max_open_files):
+    '''Interleaved runs are written as if they had been exported alone, with
+    at most ``max_open_files`` files open at once.'''
+    runs = [list(synthetic_documents(num_events=10 + n, page_size=page_size))
+            for n, page_size in enumerate([None, 3, 4])]
+    # interleave the runs, leaving the last one unfinished.
+    del runs[-1][-1]
+    documents = [doc for docs in zip(*runs) for doc in docs]
+    documents.extend(doc for docs in runs for doc in docs[len(runs[-1]):])
+
+    lock = threading.Lock()
+    open_files = peak = 0
+
+    def file_opened(key, filename):
+        nonlocal open_files, peak
+        with lock:
+            open_files += 1
+            peak = max(peak, open_files)
+
+    def closed(artifacts):
+        nonlocal open_files
+        with lock:
+            open_files -= len(artifacts['stream_data'])
+
+    with MultiRunSerializer(tmp_path / 'multi', max_workers=2,
+                            max_open_files=max_open_files,
+                            hooks={'on_file_open': file_opened,
+                                   'on_close': closed}) as serializer:
+        for i, (name, doc) in enumerate(documents):
+            serializer(name, doc)
+            if i == len(runs) - 1:  # all of the runs have started
+                waiting = len(serializer._waiting)
+    # the unfinished run is closed along with the MultiRunSerializer.
+    assert set(serializer.artifacts) == {docs[0][1]['uid'] for docs in runs}
+    if max_open_files is None:
+        assert waiting == 0
+    else:
+        assert waiting == len(runs) - 1
+        assert peak <= max_open_files
+    assert open_files == 0
+
+    for docs in runs:
+        expected = export(docs, tmp_path / 'single')
+        for filename in expected['stream_data']:
+            with open(filename) as file, open(
+                    tmp_path / 'multi' / filename.name) as actual:
+                assert actual.read() == file.read()